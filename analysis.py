@@ -0,0 +1,120 @@
+# Batch position analysis: searches many positions over a process pool and streams one result per position
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.analysis --input positions.jsonl --output results.jsonl --depth 6 --workers 8
+# Each input line is a JSON object with "board" (rows of 0 empty, 1 and 2), "player" (the side to move, 1 or 2) and
+# optionally "depth" or "time" (seconds) overriding the defaults, and "id"; each output line has the position's
+# "index" (and "id"), "move", "score", "pv", "depth", "nodes", "seconds" and "source", or "error"
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from agents.student_agent import StudentAgent, get_worker_context
+
+# Analysis agent of a pool worker process, kept between positions so its tables are only allocated once
+ANALYSIS_AGENT = None
+
+def analyse_task(index, position, depth, seconds):
+    """
+    Analyse one input position in a worker, returns its result record (an "error" record for invalid input)
+    """
+    global ANALYSIS_AGENT
+    record = {"index": index}
+    if "id" in position:
+        record["id"] = position["id"]
+    try:
+        chess_board = np.array(position["board"], dtype=int)
+        player = int(position["player"])
+        if chess_board.ndim != 2 or chess_board.shape[0] != chess_board.shape[1] or player not in (1, 2):
+            raise ValueError("board must be square and player 1 or 2")
+        if position.get("depth") is not None or position.get("time") is not None:
+            depth, seconds = position.get("depth"), position.get("time")
+        if ANALYSIS_AGENT is None:
+            ANALYSIS_AGENT = StudentAgent()
+            ANALYSIS_AGENT.use_opening_book = False
+        record.update(ANALYSIS_AGENT.analyse(chess_board, player, 3 - player, depth, seconds))
+    except Exception as error:
+        record["error"] = f"{type(error).__name__}: {error}"
+    return record
+
+def analyse_positions(positions, depth=None, seconds=None, workers=None, ordered=True, max_pending=None):
+    """
+    Analyse an iterable of positions (dicts as in the input lines) over a pool of worker processes, yielding each
+    result as soon as it is available: in input order (ordered=True) or in completion order.
+    The input is read lazily and at most max_pending positions (default 4 per worker) are submitted or waiting to be
+    yielded at any time, so memory stays bounded however long the input is and however slowly results are consumed
+    """
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 4 * workers
+    inputs = enumerate(positions)
+    exhausted = False
+    pending = set()
+    finished = {}  # index -> record, completed but waiting for earlier positions (input order)
+    next_index = 0  # next result to yield in input order
+    submitted = 0
+
+    with ProcessPoolExecutor(workers, mp_context=get_worker_context()) as pool:
+        while True:
+            # Keep the pool fed, within the window of max_pending positions past the next one to yield
+            while not exhausted and (submitted - next_index if ordered else len(pending)) < max_pending:
+                try:
+                    index, position = next(inputs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(analyse_task, index, position, depth, seconds))
+                submitted += 1
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                if ordered:
+                    finished[record["index"]] = record
+                else:
+                    next_index += 1
+                    yield record
+            while ordered and next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+
+def read_positions(input_file):
+    """
+    Parse the non-empty lines of a JSON-lines input lazily
+    """
+    for line in input_file:
+        if line.strip():
+            yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a stream of positions with the student agent")
+    parser.add_argument("--input", default="-", help="JSON-lines positions (default: standard input)")
+    parser.add_argument("--output", default="-", help="JSON-lines results (default: standard output)")
+    parser.add_argument("--depth", type=int, default=None, help="search depth of every position")
+    parser.add_argument("--time", type=float, default=None, help="seconds per position (instead of a depth)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--order", choices=["input", "completion"], default="input",
+                        help="write results in input order or as soon as each one is done")
+    parser.add_argument("--max_pending", type=int, default=None,
+                        help="positions in flight at most (default: 4 per worker)")
+    args = parser.parse_args()
+    if args.depth is None and args.time is None:
+        args.depth = 6
+
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for record in analyse_positions(read_positions(input_file), args.depth, args.time, args.workers,
+                                        args.order == "input", args.max_pending):
+            output_file.write(json.dumps(record) + "\n")
+            output_file.flush()
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Headless self-play arena: plays two configurations of the student agent against each other over a process pool
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.arena --sizes 6 8 --openings 50 --time 0.1 --agent_b '{"pattern_evaluation": true}' --output arena.jsonl
+import argparse
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from agents.student_agent import (StudentAgent, BOARD_SIZES, canonical_position, get_worker_context,
+                                  bitboard_valid_moves, initial_position, play, squares_of, popcount)
+
+# Random plies played from the start position to make the candidate openings of each board size
+OPENING_PLIES = {4: 2, 6: 3, 8: 4, 10: 4, 12: 6, 14: 6, 16: 8}
+# Candidates generated per kept opening, the kept ones are those the opening search scores closest to even
+OPENING_CANDIDATES = 4
+
+def to_board(player_one_bits, player_two_bits, board_size):
+    """
+    Numpy board as the simulator passes it to step, player 1 and player 2 discs
+    """
+    board = np.zeros(board_size * board_size, dtype=int)
+    board[squares_of(player_one_bits)] = 1
+    board[squares_of(player_two_bits)] = 2
+    return board.reshape(board_size, board_size)
+
+def balanced_openings(board_size, count, plies, depth, seed):
+    """
+    Positions `plies` random moves after the start (distinct up to symmetry), mover to move, as (mover_bits, other_bits).
+    Generates OPENING_CANDIDATES times more than needed and keeps those whose depth `depth` search score is closest
+    to even, so that neither colour starts from a decided position
+    """
+    rng = random.Random(seed)
+    agent = StudentAgent()
+    agent.use_opening_book = False
+    agent.set_board_size(board_size)
+    agent.time_limit = float('inf')
+
+    candidates = {}
+    attempts = 0
+    while len(candidates) < count * OPENING_CANDIDATES and attempts < count * OPENING_CANDIDATES * 20:
+        attempts += 1
+        mover_bits, other_bits = initial_position(board_size)
+        for ply in range(plies):
+            moves = squares_of(bitboard_valid_moves(mover_bits, other_bits, board_size))
+            if not moves:
+                break
+            mover_bits, other_bits = play(mover_bits, other_bits, moves[rng.randrange(len(moves))], board_size)
+        if not bitboard_valid_moves(mover_bits, other_bits, board_size):
+            continue
+        key, symmetry = canonical_position(mover_bits, other_bits, board_size)
+        candidates.setdefault(key, (mover_bits, other_bits))
+
+    scored = []
+    for mover_bits, other_bits in candidates.values():
+        agent.killer_moves = {}
+        agent.transposition_table.new_search()
+        move, score = agent.alpha_beta_search(mover_bits, other_bits, depth)
+        scored.append((abs(score), mover_bits, other_bits))
+    scored.sort(key=lambda candidate: candidate[0])
+    agent.close()
+    return [(mover_bits, other_bits) for balance, mover_bits, other_bits in scored[:count]]
+
+def make_agent(config, time_per_move, nodes_per_move):
+    """
+    Build a StudentAgent from a configuration: the constructor's keyword arguments (optimized_weights,
+    pattern_evaluation, ...) plus an optional "attributes" dict of attributes set afterwards (use_opening_book,
+    endgame_empties, ...). With a node budget the agent searches a fixed number of nodes per move instead of the clock
+    """
+    config = dict(config)
+    attributes = config.pop("attributes", {})
+    config.pop("name", None)
+    agent = StudentAgent(**config)
+    for name, value in attributes.items():
+        setattr(agent, name, value)
+    if nodes_per_move:
+        agent.max_time_per_turn = float('inf')
+        agent.node_limit = nodes_per_move
+    else:
+        agent.max_time_per_turn = time_per_move
+    return agent
+
+def play_game(game_id, board_size, opening_index, mover_bits, other_bits, a_color, configs, time_per_move,
+              nodes_per_move, seed):
+    """
+    Play one game from an opening, agent "a" with colour a_color (1 moves first in the opening position) against
+    agent "b", in a pool worker. An illegal move loses the game. Returns the game's result record
+    """
+    np.random.seed(seed)
+    names = {a_color: "a", 3 - a_color: "b"}
+    agents = {color: make_agent(configs[names[color]], time_per_move, nodes_per_move) for color in (1, 2)}
+    bits = {1: mover_bits, 2: other_bits}
+    stats = {name: {"moves": 0, "seconds": 0.0, "max_seconds": 0.0, "nodes": 0} for name in ("a", "b")}
+    moves = []
+    forfeit = None
+    turn = 1
+    game_start = time.time()
+    try:
+        while True:
+            legal = bitboard_valid_moves(bits[turn], bits[3 - turn], board_size)
+            if not legal:
+                if not bitboard_valid_moves(bits[3 - turn], bits[turn], board_size):
+                    break
+                turn = 3 - turn  # pass, the simulator does not ask the agent either
+                continue
+            agent = agents[turn]
+            move_start = time.time()
+            move = agent.step(to_board(bits[1], bits[2], board_size), turn, 3 - turn)
+            seconds = time.time() - move_start
+            player_stats = stats[names[turn]]
+            player_stats["moves"] += 1
+            player_stats["seconds"] += seconds
+            player_stats["max_seconds"] = max(player_stats["max_seconds"], seconds)
+            player_stats["nodes"] += agent.nodes_visited_total
+            square = None if move is None else move[0] * board_size + move[1]
+            if square is None or not 0 <= square < board_size * board_size or not legal >> square & 1:
+                forfeit = names[turn]
+                break
+            bits[turn], bits[3 - turn] = play(bits[turn], bits[3 - turn], square, board_size)[::-1]
+            moves.append(square)
+            turn = 3 - turn
+    finally:
+        for agent in agents.values():
+            agent.close()
+
+    a_discs, b_discs = popcount(bits[a_color]), popcount(bits[3 - a_color])
+    if forfeit is not None:
+        result = 0.0 if forfeit == "a" else 1.0
+    else:
+        result = 1.0 if a_discs > b_discs else 0.0 if a_discs < b_discs else 0.5
+    return {
+        "game": game_id,
+        "board_size": board_size,
+        "opening": opening_index,
+        "a_color": a_color,
+        "result": result,
+        "a_discs": a_discs,
+        "b_discs": b_discs,
+        "forfeit": forfeit,
+        "moves": moves,
+        "seconds": time.time() - game_start,
+        "a": stats["a"],
+        "b": stats["b"],
+    }
+
+def elo_difference(score):
+    """
+    Elo difference corresponding to an expected score (infinite for 0 or 1)
+    """
+    if score <= 0:
+        return float('-inf')
+    if score >= 1:
+        return float('inf')
+    return -400 * math.log10(1 / score - 1) + 0.0  # no -0
+
+def summarize(results):
+    """
+    Wins, draws and losses of agent "a", its score and the Elo difference with a 95% interval
+    """
+    games = len(results)
+    wins = sum(1 for record in results if record["result"] == 1.0)
+    draws = sum(1 for record in results if record["result"] == 0.5)
+    summary = {"games": games, "wins": wins, "draws": draws, "losses": games - wins - draws}
+    if games:
+        scores = np.array([record["result"] for record in results])
+        score = scores.mean()
+        margin = 1.96 * scores.std() / math.sqrt(games)
+        summary.update({"score": score, "elo": elo_difference(score),
+                        "elo_low": elo_difference(score - margin), "elo_high": elo_difference(score + margin)})
+    return summary
+
+def format_summary(label, summary):
+    if not summary["games"]:
+        return f"{label}: no games"
+    return (f"{label}: {summary['games']} games, a +{summary['wins']} ={summary['draws']} -{summary['losses']}, "
+            f"score {summary['score']:.3f}, elo {summary['elo']:+.0f} "
+            f"[{summary['elo_low']:+.0f}, {summary['elo_high']:+.0f}]")
+
+def load_config(text):
+    """
+    Agent configuration from a JSON string or the path of a JSON file
+    """
+    if os.path.exists(text):
+        with open(text) as config_file:
+            return json.load(config_file)
+    return json.loads(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="Play two configurations of the student agent against each other")
+    parser.add_argument("--agent_a", default="{}", help="JSON configuration (or file) of agent a")
+    parser.add_argument("--agent_b", default="{}", help="JSON configuration (or file) of agent b")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[6, 8, 10, 12], choices=BOARD_SIZES)
+    parser.add_argument("--openings", type=int, default=20,
+                        help="balanced openings per board size (fewer if the size has not that many), each played "
+                             "twice with the colours swapped")
+    parser.add_argument("--opening_depth", type=int, default=3, help="search depth used to pick balanced openings")
+    parser.add_argument("--time", type=float, default=0.1, help="seconds per move")
+    parser.add_argument("--nodes", type=int, default=None, help="fixed nodes per move instead of time (reproducible)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="arena.jsonl", help="one JSON line per finished game")
+    parser.add_argument("--resume", action="store_true", help="skip the games already in the output file")
+    args = parser.parse_args()
+
+    configs = {"a": load_config(args.agent_a), "b": load_config(args.agent_b)}
+    tasks = []
+    for board_size in args.sizes:
+        openings = balanced_openings(board_size, args.openings, OPENING_PLIES[board_size], args.opening_depth,
+                                     args.seed + board_size)
+        for opening_index, (mover_bits, other_bits) in enumerate(openings):
+            for a_color in (1, 2):
+                tasks.append((len(tasks), board_size, opening_index, mover_bits, other_bits, a_color))
+
+    results = []
+    if args.resume and os.path.exists(args.output):
+        with open(args.output) as output_file:
+            results = [json.loads(line) for line in output_file if line.strip()]
+    done = {record["game"] for record in results}
+
+    start_time = time.time()
+    with open(args.output, "a" if args.resume else "w") as output_file, \
+            ProcessPoolExecutor(args.workers, mp_context=get_worker_context()) as pool:
+        futures = [pool.submit(play_game, *task, configs, args.time, args.nodes, args.seed + task[0])
+                   for task in tasks if task[0] not in done]
+        for finished, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            output_file.write(json.dumps(record) + "\n")
+            output_file.flush()
+            results.append(record)
+            if finished % max(1, len(futures) // 20) == 0 or finished == len(futures):
+                elapsed = time.time() - start_time
+                print(f"{finished}/{len(futures)} games in {elapsed:.0f}s ({finished / elapsed * 60:.1f}/min), "
+                      f"{format_summary('total', summarize(results))}", flush=True)
+
+    for board_size in args.sizes:
+        print(format_summary(f"{board_size}x{board_size}",
+                             summarize([record for record in results if record["board_size"] == board_size])))
+    print(format_summary("total", summarize(results)))
+
+if __name__ == "__main__":
+    main()
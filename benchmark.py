@@ -0,0 +1,247 @@
+# Benchmark and perft suite for the student agent: move generator correctness and search/evaluation throughput
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.benchmark --sizes 8 12 --output bench.json
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import numpy as np
+from agents.student_agent import StudentAgent, SearchBoard, BOARD_SIZES, squares_of, popcount, initial_position
+
+# Known perft counts of the standard 8x8 starting position (passes count as a ply), used to check the move generator
+EXPECTED_PERFT_8x8 = [1, 4, 12, 56, 244, 1396, 8200, 55092, 390216]
+
+# Corpus: positions reached by seeded random games, at these fractions of the board filled
+CORPUS_SEEDS = [0, 1, 2]
+CORPUS_FILL = [0.25, 0.5, 0.75]
+
+def build_corpus(board_size):
+    """
+    Build the fixed corpus of a board size: the start position plus, for each seed, the positions of a seeded random
+    game when the board is 25%, 50% and 75% full. Positions are (name, mover_bits, other_bits) with mover to move
+    """
+    corpus = [("start", *initial_position(board_size))]
+    for seed in CORPUS_SEEDS:
+        rng = random.Random(seed)
+        board = SearchBoard(*initial_position(board_size), board_size)
+        for fill in CORPUS_FILL:
+            target = int(board_size * board_size * fill)
+            while popcount(board.player_bits | board.opponent_bits) < target:
+                moves = squares_of(board.get_valid_moves())
+                if moves:
+                    board.make_move(moves[rng.randrange(len(moves))])
+                elif board.get_opponent_moves():
+                    board.pass_turn()
+                else:
+                    break
+            if board.get_valid_moves():
+                mover_bits, other_bits = board.player_bits, board.opponent_bits
+                if not board.maximizing_player:
+                    mover_bits, other_bits = other_bits, mover_bits
+                corpus.append((f"seed{seed}_fill{int(fill * 100)}", mover_bits, other_bits))
+    return corpus
+
+def perft(board, depth):
+    """
+    Count the leaf positions depth plies below the board (a forced pass is a ply, a finished game is a leaf)
+    """
+    if depth == 0:
+        return 1
+    moves = board.get_valid_moves()
+    if not moves:
+        if not board.get_opponent_moves():
+            return 1
+        board.pass_turn()
+        nodes = perft(board, depth - 1)
+        board.unmake_move()
+        return nodes
+    if depth == 1:
+        return popcount(moves)
+    nodes = 0
+    for move in squares_of(moves):
+        board.make_move(move)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+def reference_perft(chess_board, player, depth):
+    """
+    Perft with the simulator's own helpers on a numpy board, slow but independent of the bitboard code
+    """
+    from helpers import get_valid_moves, execute_move
+    if depth == 0:
+        return 1
+    moves = get_valid_moves(chess_board, player)
+    if not moves:
+        if not get_valid_moves(chess_board, 3 - player):
+            return 1
+        return reference_perft(chess_board, 3 - player, depth - 1)
+    nodes = 0
+    for move in moves:
+        child = chess_board.copy()
+        execute_move(child, move, player)
+        nodes += reference_perft(child, 3 - player, depth - 1)
+    return nodes
+
+def bitboards_to_board(mover_bits, other_bits, board_size):
+    """
+    Numpy board with the mover as player 1 and the other side as player 2
+    """
+    chess_board = np.zeros(board_size * board_size, dtype=int)
+    chess_board[squares_of(mover_bits)] = 1
+    chess_board[squares_of(other_bits)] = 2
+    return chess_board.reshape(board_size, board_size)
+
+def measure_rate(operation, seconds):
+    """
+    Call operation() (which returns how many items it processed) repeatedly for about `seconds`, returns items/second
+    """
+    items = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        items += operation()
+        elapsed = time.perf_counter() - start
+    return items / elapsed
+
+def benchmark_throughput(board_size, corpus, seconds):
+    """
+    Throughput of move generation, make/unmake and evaluation over the corpus positions
+    """
+    agent = StudentAgent()
+    # Single-entry caches, emptied before each pass over the corpus: every evaluation is a miss, so the figure
+    # measures the evaluator rather than the evaluation cache's lookup
+    agent.evaluation_cache_bytes = agent.ordering_cache_bytes = 0
+    agent.set_board_size(board_size)
+    boards = [SearchBoard(mover_bits, other_bits, board_size) for name, mover_bits, other_bits in corpus]
+    moves = [squares_of(board.get_valid_moves()) for board in boards]
+
+    def generate_moves():
+        for board in boards:
+            board.get_valid_moves()
+        return len(boards)
+
+    def make_unmake():
+        count = 0
+        for board, board_moves in zip(boards, moves):
+            for move in board_moves:
+                board.make_move(move)
+                board.unmake_move()
+            count += len(board_moves)
+        return count
+
+    def evaluate():
+        agent.clear_caches()
+        for board in boards:
+            agent.evaluate_board(board)
+        return len(boards)
+
+    return {
+        "get_valid_moves_per_second": measure_rate(generate_moves, seconds),
+        "make_unmake_per_second": measure_rate(make_unmake, seconds),
+        "evaluate_board_per_second": measure_rate(evaluate, seconds),
+    }
+
+def benchmark_search(board_size, corpus, max_depth):
+    """
+    Time-to-depth and node counts of alpha_beta_search (fresh agent, iterative deepening up to max_depth)
+    """
+    results = []
+    for name, mover_bits, other_bits in corpus:
+        agent = StudentAgent()
+        agent.use_opening_book = False
+        agent.set_board_size(board_size)
+        agent.transposition_table.new_search()
+        agent.time_limit = float('inf')
+        depths = []
+        start = time.perf_counter()
+        for depth in range(1, max_depth + 1):
+            move, score = agent.alpha_beta_search(mover_bits, other_bits, depth)
+            depths.append({
+                "depth": depth,
+                "seconds": time.perf_counter() - start,
+                "nodes": agent.nodes_visited_total,
+                "leaves": agent.leaf,
+                "best_move": move,
+                "score": score,
+            })
+        total = depths[-1]
+        results.append({"position": name, "depths": depths,
+                        "nodes_per_second": total["nodes"] / total["seconds"] if total["seconds"] else 0.0})
+    return results
+
+def benchmark_size(board_size, perft_depth, search_depth, seconds, verify):
+    """
+    Run the whole suite for one board size
+    """
+    corpus = build_corpus(board_size)
+    perft_results = []
+    for name, mover_bits, other_bits in corpus:
+        start = time.perf_counter()
+        nodes = perft(SearchBoard(mover_bits, other_bits, board_size), perft_depth)
+        entry = {"position": name, "depth": perft_depth, "nodes": nodes, "seconds": time.perf_counter() - start}
+        if verify:
+            expected = reference_perft(bitboards_to_board(mover_bits, other_bits, board_size), 1, perft_depth)
+            entry["reference_nodes"] = expected
+            entry["ok"] = nodes == expected
+        perft_results.append(entry)
+    if board_size == 8:
+        for depth in range(min(len(EXPECTED_PERFT_8x8) - 1, perft_depth + 2) + 1):
+            nodes = perft(SearchBoard(*initial_position(8), 8), depth)
+            perft_results.append({"position": "start", "depth": depth, "nodes": nodes,
+                                  "reference_nodes": EXPECTED_PERFT_8x8[depth],
+                                  "ok": nodes == EXPECTED_PERFT_8x8[depth]})
+
+    return {
+        "perft": perft_results,
+        "throughput": benchmark_throughput(board_size, corpus, seconds),
+        "search": benchmark_search(board_size, corpus[1:], search_depth),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft and throughput benchmark of the student agent")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[6, 8, 10, 12], choices=BOARD_SIZES)
+    parser.add_argument("--perft_depth", type=int, default=4)
+    parser.add_argument("--search_depth", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=1.0, help="duration of each throughput measurement")
+    parser.add_argument("--verify", action="store_true", help="check perft against the simulator's helpers (slow)")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "perft_depth": args.perft_depth,
+            "search_depth": args.search_depth,
+        },
+        "sizes": {},
+    }
+    failed = False
+    for board_size in args.sizes:
+        size_results = benchmark_size(board_size, args.perft_depth, args.search_depth, args.seconds, args.verify)
+        results["sizes"][str(board_size)] = size_results
+
+        throughput = size_results["throughput"]
+        search_nodes = sum(position["depths"][-1]["nodes"] for position in size_results["search"])
+        search_seconds = sum(position["depths"][-1]["seconds"] for position in size_results["search"])
+        bad_perft = [entry for entry in size_results["perft"] if entry.get("ok") is False]
+        failed = failed or bool(bad_perft)
+        print(f"{board_size}x{board_size}: perft {'FAILED' if bad_perft else 'ok'}, "
+              f"moves {throughput['get_valid_moves_per_second']:.0f}/s, "
+              f"make/unmake {throughput['make_unmake_per_second']:.0f}/s, "
+              f"eval {throughput['evaluate_board_per_second']:.0f}/s, "
+              f"search depth {args.search_depth}: {search_nodes} nodes in {search_seconds:.2f}s "
+              f"({search_nodes / search_seconds if search_seconds else 0:.0f} nodes/s)", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
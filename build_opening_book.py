@@ -0,0 +1,87 @@
+# Opening book builder: grows the opening book of student_agent.py with deep offline searches
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.build_opening_book --board_size 8 --moves 4 --depth 8
+import argparse
+import time
+from agents.student_agent import (StudentAgent, OpeningBook, BOARD_SIZES, SYMMETRIES, INVERSE_SYMMETRIES,
+                                  canonical_position, opening_book_path, bitboard_valid_moves, initial_position, play,
+                                  squares_of)
+
+def search_position(agent, mover_bits, other_bits, depth):
+    """
+    Run the agent's alpha-beta search to a fixed depth without time limit, returns (best_move, score)
+    """
+    agent.time_limit = float('inf')
+    agent.killer_moves = {}
+    agent.history_table = {}
+    agent.transposition_table.new_search()
+    return agent.alpha_beta_search(mover_bits, other_bits, depth)
+
+def grow_book(board_size, moves, depth, entries):
+    """
+    Add book entries for every position where we are to move within our first `moves` moves, playing first or second:
+    we follow the book's best move and consider every reply of the opponent.
+    Positions already in the book at this depth or deeper are not searched again
+    """
+    agent = StudentAgent()
+    agent.use_opening_book = False
+    agent.set_board_size(board_size)
+
+    start = initial_position(board_size)
+    # Playing first we move in the start position, playing second after each of the opponent's first moves
+    frontier = [start] + [play(*start, move, board_size)
+                          for move in squares_of(bitboard_valid_moves(*start, board_size))]
+    searched = 0
+    for our_move in range(moves):
+        next_frontier = []
+        seen = set()
+        for mover_bits, other_bits in frontier:
+            key, symmetry = canonical_position(mover_bits, other_bits, board_size)
+            if key in seen or not bitboard_valid_moves(mover_bits, other_bits, board_size):
+                continue
+            seen.add(key)
+
+            if key in entries and entries[key][2] >= depth:
+                canonical_move = entries[key][0]
+                move = INVERSE_SYMMETRIES[board_size][symmetry][canonical_move]
+            else:
+                start_time = time.time()
+                move, score = search_position(agent, mover_bits, other_bits, depth)
+                entries[key] = (SYMMETRIES[board_size][symmetry][move], score, depth)
+                searched += 1
+                print(f"move {our_move + 1}/{moves}: {len(entries)} entries, searched {divmod(move, board_size)} "
+                      f"score {score:.1f} in {time.time() - start_time:.1f}s", flush=True)
+
+            # Every reply of the opponent leads to a position of the next frontier
+            opponent_bits, our_bits = play(mover_bits, other_bits, move, board_size)
+            replies = squares_of(bitboard_valid_moves(opponent_bits, our_bits, board_size))
+            if not replies:
+                next_frontier.append((our_bits, opponent_bits)) # opponent passes, we move again
+            for reply in replies:
+                next_frontier.append(play(opponent_bits, our_bits, reply, board_size))
+        frontier = next_frontier
+    return searched
+
+def main():
+    parser = argparse.ArgumentParser(description="Grow the opening book of the student agent with offline searches")
+    parser.add_argument("--board_size", type=int, default=8, choices=BOARD_SIZES)
+    parser.add_argument("--moves", type=int, default=3, help="number of our own moves covered by the book")
+    parser.add_argument("--depth", type=int, default=7, help="alpha-beta search depth for each book position")
+    parser.add_argument("--output", default=None, help="book file (default: the one the agent loads)")
+    args = parser.parse_args()
+
+    path = args.output or opening_book_path(args.board_size)
+    entries = {}
+    try:
+        book = OpeningBook(path)
+        for record in book.records:
+            entries[int(record["key"])] = (int(record["move"]), float(record["score"]), int(record["depth"]))
+    except FileNotFoundError:
+        pass
+
+    searched = grow_book(args.board_size, args.moves, args.depth, entries)
+    OpeningBook.write(path, args.board_size, entries)
+    print(f"{path}: {len(entries)} entries ({searched} new searches)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Multi-ProbCut calibration: fits the linear models that predict a deep search score from a shallow one
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.calibrate_probcut --board_size 8 --positions 300 --max_depth 8
+# then replace the board size's entry of MPC_PARAMETERS in student_agent.py with the printed one
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from agents.student_agent import (StudentAgent, BOARD_SIZES, ENDGAME_EMPTIES, get_worker_context, bitboard_valid_moves,
+                                  initial_position, play, squares_of, popcount)
+
+def sample_positions(board_size, count, seed):
+    """
+    Midgame positions (mover to move) of seeded random games, with a number of discs drawn uniformly between the
+    opening and the exact endgame solver's threshold, where the heuristic search is used
+    """
+    rng = random.Random(seed)
+    total_squares = board_size * board_size
+    last_discs = total_squares - ENDGAME_EMPTIES.get(board_size, 0) - 1
+    positions = []
+    while len(positions) < count:
+        target = rng.randint(6, last_discs)
+        mover_bits, other_bits = initial_position(board_size)
+        while popcount(mover_bits | other_bits) < target:
+            moves = squares_of(bitboard_valid_moves(mover_bits, other_bits, board_size))
+            if not moves:
+                if not bitboard_valid_moves(other_bits, mover_bits, board_size):
+                    break
+                mover_bits, other_bits = other_bits, mover_bits
+                continue
+            mover_bits, other_bits = play(mover_bits, other_bits, moves[rng.randrange(len(moves))], board_size)
+        if popcount(mover_bits | other_bits) == target and bitboard_valid_moves(mover_bits, other_bits, board_size):
+            positions.append((mover_bits, other_bits))
+    return positions
+
+def search_scores(board_size, mover_bits, other_bits, max_depth):
+    """
+    Scores of the plain (non selective) search of a position at depths 1 to max_depth, from the mover's point of view
+    """
+    agent = StudentAgent()
+    agent.use_opening_book = False
+    agent.probcut = False
+    agent.set_board_size(board_size)
+    agent.transposition_table.new_search()
+    agent.time_limit = float('inf')
+    scores = []
+    for depth in range(1, max_depth + 1):
+        move, score = agent.alpha_beta_search(mover_bits, other_bits, depth)
+        scores.append(score)
+    agent.close()
+    return scores
+
+def fit_pairs(scores, max_depth, shallow_gap):
+    """
+    For each deep depth, the least squares fit deep = slope * shallow + intercept (with the standard deviation of
+    the residuals) against every shallower depth of the same parity (the evaluation swings between odd and even
+    depths) at most shallow_gap plies below. Returns {depth: [(shallow_depth, slope, intercept, sigma), ...]} ordered
+    from the cheapest shallow search
+    """
+    parameters = {}
+    for depth in range(3, max_depth + 1):
+        cuts = []
+        for shallow_depth in range(max(1, depth - shallow_gap), depth - 1):
+            if (depth - shallow_depth) % 2:
+                continue
+            shallow, deep = scores[:, shallow_depth - 1], scores[:, depth - 1]
+            slope, intercept = np.polyfit(shallow, deep, 1)
+            sigma = np.std(deep - (slope * shallow + intercept))
+            cuts.append((shallow_depth, round(float(slope), 3), round(float(intercept), 1), round(float(sigma), 1)))
+        if cuts:
+            parameters[depth] = cuts
+    return parameters
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the Multi-ProbCut parameters of the student agent")
+    parser.add_argument("--board_size", type=int, default=8, choices=BOARD_SIZES)
+    parser.add_argument("--positions", type=int, default=200)
+    parser.add_argument("--max_depth", type=int, default=7, help="deepest search depth to calibrate")
+    parser.add_argument("--shallow_gap", type=int, default=4, help="largest depth difference of a cut pair")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="also save the raw scores (npz) to this file")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    positions = sample_positions(args.board_size, args.positions, args.seed)
+    count = len(positions)
+    with ProcessPoolExecutor(args.workers, mp_context=get_worker_context()) as pool:
+        scores = np.array(list(pool.map(search_scores, [args.board_size] * count,
+                                        [mover_bits for mover_bits, other_bits in positions],
+                                        [other_bits for mover_bits, other_bits in positions],
+                                        [args.max_depth] * count)))
+    print(f"{count} positions searched to depth {args.max_depth} in {time.time() - start_time:.1f}s")
+    if args.output:
+        discs = np.array([popcount(mover_bits | other_bits) for mover_bits, other_bits in positions])
+        np.savez_compressed(args.output, scores=scores, discs=discs)
+
+    parameters = fit_pairs(scores, args.max_depth, args.shallow_gap)
+    for depth, cuts in parameters.items():
+        for shallow_depth, slope, intercept, sigma in cuts:
+            correlation = np.corrcoef(scores[:, shallow_depth - 1], scores[:, depth - 1])[0, 1]
+            print(f"depth {depth} from {shallow_depth}: slope {slope}, intercept {intercept}, sigma {sigma}, "
+                  f"correlation {correlation:.3f}")
+    lines = [f"    {depth}: ({', '.join(str(cut) for cut in cuts)},)," for depth, cuts in parameters.items()]
+    print(f"MPC_PARAMETERS[{args.board_size}] = {{\n" + "\n".join(lines) + "\n}")
+
+if __name__ == "__main__":
+    main()
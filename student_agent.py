@@ -2,35 +2,104 @@
 from agents.agent import Agent
 from store import register_agent
 import sys
+import array
+import os
 import numpy as np
 from copy import deepcopy
 import time
+import json
+import random
+from collections import defaultdict
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
 from helpers import random_move, count_capture, get_directions, check_endgame, get_valid_moves
 
 @register_agent("student_agent")
 class StudentAgent(Agent):
-    def __init__(self, optimized_weights=None):
+    def __init__(self, optimized_weights=None, search_workers=1, pondering=False, pattern_evaluation=False,
+                 weights_path=None, engine="alphabeta"):
         super(StudentAgent, self).__init__()
+        if engine not in ("alphabeta", "mcts"):
+            raise ValueError(f"unknown engine {engine!r}, expected 'alphabeta' or 'mcts'")
         self.name = "StudentAgent"
         self.autoplay = True
         self.max_time_per_turn = 1.95 
         self.start_time = None
         self.time_limit = None
+        self.time_manager = None  # TimeManager of the current turn, None searches until the deadline
+        self.node_limit = None  # when set, a search also stops after this many nodes per move (e.g. fixed-node games)
         self.killer_moves = {}
         self.history_table = {}
+        # Search state carried over to the next turn: the last principal variation as {position hash: move}, the
+        # disc count of the last root and the position the principal variation predicts for the next turn with its
+        # (move, score, searched depth, iteration scores), see carry_over_search_state
+        self.pv_map = {}
+        self.previous_root_discs = None
+        self.predicted_position = None
+        self.iteration_scores = {}
         self.nodes_visited_total = 0
         self.nodes_visited_for_move = 0
-        self.transposition_table = {}
-        self.transposition_table_keys = []
-        self.transposition_table_limit = 1000000
+        self.transposition_table = None  # allocated on the first step, then kept across turns
+        self.transposition_table_limit = 1 << 20
         self.history_table_limit = 1000000
+        # Bounded caches kept across turns: disc hash -> (evaluation, our moves, their moves), and position hash ->
+        # static move ordering scores. Their memory budgets (bytes) are read when they are allocated
+        self.evaluation_cache_bytes = 64 << 20
+        self.ordering_cache_bytes = 32 << 20
+        self.evaluation_cache = None
+        self.ordering_cache = None
+        self.geometry = None  # BoardGeometry of the current board size, shared by the agents of the process
         self.positional_weights = None
         self.leaf = 0
+        self.board = None
+        # Exact endgame solver: switches on at or below this many empty squares (per board size)
+        self.endgame_empties = dict(ENDGAME_EMPTIES)
+        self.endgame_mode = "exact"  # "exact" maximizes the final disc difference, "wld" only solves win/loss/draw
+        self.endgame_time_fraction = 0.6  # share of the turn the solver may use before falling back to IDS
+        # Multi-ProbCut: prune nodes whose shallow search predicts a result far outside the window (MPC_PARAMETERS)
+        self.probcut = False
+        self.probcut_threshold = MPC_THRESHOLD
+        self.probcut_cuts = {}
+        # Parallel search: with more than 1 worker, search_workers - 1 helper processes run Lazy SMP on a shared table
+        self.search_workers = search_workers
+        self.worker_pool = None
+        # Pondering: after each move, a background process searches the position after the predicted reply
+        self.pondering = pondering
+        self.ponder_pool = None
+        self.ponder_future = None
+        self.ponder_position = None
+        # Token of the current background search (ponder or Lazy SMP helpers), written to the shared table's control
+        # word: a helper stops as soon as the word no longer holds the token it was started with
+        self.search_token = 0
+        self.abort_token = None  # set in helper processes, the search stops when the table's token changes
+        # Opening book (one memory-mapped file per board size, built offline with build_opening_book.py)
+        self.use_opening_book = True
+        # Pattern evaluation: evaluate leaves with the pattern tables (fitted with train_patterns.py) instead of the
+        # 8 handcrafted heuristics
+        self.pattern_evaluation = pattern_evaluation
+        self.patterns = None
+        # Search engine: "alphabeta" (iterative deepening) or "mcts" (Monte Carlo tree search with batched playouts,
+        # see mcts_search). Book moves, forced moves and the endgame solver are shared by both
+        self.engine = engine
+        self.mcts_selection = "puct"  # "uct", or "puct" guided by the move ordering priors
+        self.mcts_exploration = None  # None for the selection rule's MCTS_EXPLORATION constant
+        self.mcts_batch_size = MCTS_BATCH_SIZE
+        self.mcts_tree_nodes = MCTS_TREE_NODES
+        self.mcts_rollout_temperature = MCTS_ROLLOUT_TEMPERATURE
+        self.mcts_tree = None  # MCTSTree kept across turns, its subtree of the new position is reused
+        # Telemetry: when a hook is set, each step collects SearchStatistics and passes them to it as one JSON line
+        self.telemetry_hook = None
+        self.stats = None
 
         if optimized_weights is None:
             self.optimized_weights = self.load_optimized_weights()
         else:
             self.optimized_weights = optimized_weights
+        # Tuned weights (written by tune_weights.py): per board size, the 8 heuristic weights of each phase. They
+        # replace optimized_weights and the board size tunings for the sizes they cover
+        self.tuned_weights = load_tuned_weights(weights_path) if weights_path is not None else {}
     
     def load_optimized_weights(self):
         # Define weights for early, mid, and late game phases
@@ -73,213 +142,874 @@ class StudentAgent(Agent):
         self.time_limit = self.start_time + self.max_time_per_turn
 
         # Reset per-move variables
+        self.nodes_visited_total = 0
+        self.leaf = 0
+        self.endgame_nodes = 0
+        self.time_manager = None
+        self.stats = SearchStatistics() if self.telemetry_hook is not None else None
+
+        # Generate positional weights and bitboard masks based on the board size. The edge stability tables are solved
+        # at import, the rest of a new size's setup (at most about 0.1s, on 16x16) is charged to the turn
+        self.set_board_size(board_size)
+        # Keep the transposition table from the previous turns, only its old entries become replaceable
+        self.transposition_table.new_search()
+
+        # Convert the board once, the whole search then runs on the two bitboards
+        player_bits, opponent_bits = board_to_bitboards(chess_board, player, opponent)
+        self.root_position = (player_bits, opponent_bits)
+        carried_move, carried_score, carried_depth, carried_scores = self.carry_over_search_state(player_bits,
+                                                                                                 opponent_bits)
+        # Stop the ponder search before anything else, whichever way this turn's move is chosen it must not compete
+        # with it for the CPU
+        pondered_move, pondered_score, pondered_depth = self.collect_ponder_result(player_bits, opponent_bits)
+
+        valid_moves = squares_of(bitboard_valid_moves(player_bits, opponent_bits, board_size))
+        if self.use_opening_book and len(valid_moves) > 1:
+            book_move = self.lookup_opening_book(player_bits, opponent_bits)
+            if book_move is not None:
+                return self.finish_step(book_move, "book")
+        if popcount(player_bits | opponent_bits) == 4 and valid_moves:
+            # make the first move random if we are playing first
+            return self.finish_step(valid_moves[np.random.randint(0, len(valid_moves))], "random")
+        if not valid_moves:  # Pass turn if no valid moves
+            return self.finish_step(None, "pass")
+        elif len(valid_moves) == 1:
+            return self.finish_step(valid_moves[0], "forced")  # Only one move
+
+        best_move = None
+        empty_squares = board_size * board_size - popcount(player_bits | opponent_bits)
+        if empty_squares <= self.endgame_empties.get(board_size, 0):
+            try:
+                solved_move, solved_score = self.solve_endgame(player_bits, opponent_bits)
+                return self.finish_step(solved_move, "endgame", solved_score)
+            except TimeoutError:
+                pass # too many nodes after all, the heuristic search gets the rest of the turn
+            self.time_limit = self.start_time + self.max_time_per_turn
+        self.time_manager = TimeManager(self.start_time, self.time_limit, empty_squares, board_size * board_size)
+        if self.engine == "mcts":
+            best_move, best_score, depth = self.mcts_search(player_bits, opponent_bits)
+            if best_move is None:
+                best_move = valid_moves[0]
+            return self.finish_step(best_move, "mcts", best_score, depth)
+
+        # If we pondered this exact position during the opponent's turn, or the previous search predicted it (its
+        # subtree was searched to carried_depth), continue after the deepest iteration already done
+        start_depth = max(pondered_depth, carried_depth) + 1
+        fallback = (pondered_move, pondered_score, pondered_depth)
+        if carried_depth > pondered_depth:
+            fallback = (carried_move, carried_score, carried_depth)
+
+        if self.search_workers > 1:
+            best_move, best_score, depth = self.parallel_search(player_bits, opponent_bits, start_depth,
+                                                                carried_scores)
+        else:
+            best_move, best_score, depth = self.iterative_deepening(player_bits, opponent_bits, start_depth,
+                                                                    iteration_scores=carried_scores)
+        if best_move is None:
+            best_move, best_score, depth = fallback
+
+        if best_move is None and valid_moves:  # go to the first valid move
+            best_move = valid_moves[0]
+        elif depth > 0:
+            self.remember_principal_variation(player_bits, opponent_bits, best_move, best_score, depth)
+        if self.pondering:
+            self.start_pondering(player_bits, opponent_bits, best_move)
+        return self.finish_step(best_move, "search", best_score, depth)
+
+    def analyse(self, chess_board, player, opponent, depth=None, seconds=None):
+        """
+        Analyse a position with player to move, searched to a fixed depth or for a number of seconds (to depth 25
+        without either), with the exact solver near the end of the game and without opening book or random move.
+        Returns a JSON-serializable dict: best move, score from player's point of view (the final disc difference when
+        solved), principal variation, depth reached, nodes searched and source (search, endgame or pass)
+        """
+        board_size = chess_board.shape[0]
+        max_time_per_turn = self.max_time_per_turn
+        self.max_time_per_turn = seconds if seconds is not None else float('inf')
         self.killer_moves = {}
-        self.history_table = {}
         self.nodes_visited_total = 0
         self.leaf = 0
-        self.transposition_table.clear()
-        self.transposition_table_keys = []
+        self.endgame_nodes = 0
+        self.time_manager = None
+        self.stats = None
+        self.start_time = time.time()
+        self.time_limit = self.start_time + self.max_time_per_turn
+        self.set_board_size(board_size)
+        self.transposition_table.new_search()
+        player_bits, opponent_bits = board_to_bitboards(chess_board, player, opponent)
 
-        # Generate positional weights based on the board size 
-        self.positional_weights = get_positional_weights(board_size)
+        valid_moves = bitboard_valid_moves(player_bits, opponent_bits, board_size)
+        empty_squares = board_size * board_size - popcount(player_bits | opponent_bits)
+        move, score, reached_depth, source = None, None, 0, "pass"
+        try:
+            # The solver is used when the requested depth reaches the end of the game anyway
+            if valid_moves and empty_squares <= self.endgame_empties.get(board_size, 0) and \
+                    (depth is None or depth >= empty_squares):
+                try:
+                    move, score = self.solve_endgame(player_bits, opponent_bits)
+                    reached_depth, source = empty_squares, "endgame"
+                except TimeoutError:
+                    self.time_limit = self.start_time + self.max_time_per_turn
+            if valid_moves and source == "pass":
+                move, score, reached_depth = self.iterative_deepening(player_bits, opponent_bits, 1, depth or 25)
+                source = "search"
+                if move is None:  # not even depth 1 in the time given
+                    move = squares_of(valid_moves)[0]
+        finally:
+            self.max_time_per_turn = max_time_per_turn
+
+        return {
+            "move": None if move is None else list(self.square_to_move(move)),
+            "score": score,
+            "pv": [] if move is None else [list(self.square_to_move(square)) for square in
+                                           self.principal_variation(player_bits, opponent_bits, move)],
+            "depth": reached_depth,
+            "nodes": self.nodes_visited_total + self.endgame_nodes,
+            "seconds": time.time() - self.start_time,
+            "source": source,
+        }
+
+    def finish_step(self, move, source, score=None, depth=0):
+        """
+        Convert the chosen square to the simulator's (row, col) move and emit the turn's telemetry record if enabled
+        source tells how the move was chosen: book, random, pass, forced, endgame, search or mcts
+        """
+        if self.stats is not None:
+            record = self.stats.to_record()
+            record.update({
+                "board_size": self.board_size,
+                "empty_squares": popcount(self.full_mask & ~(self.root_position[0] | self.root_position[1])),
+                "source": source,
+                "move": None if move is None else list(self.square_to_move(move)),
+                "score": score,
+                "depth": depth,
+                "seconds": time.time() - self.start_time,
+                "nodes": self.nodes_visited_total,
+                "leaves": self.leaf,
+                "endgame_nodes": self.endgame_nodes if source == "endgame" else 0,
+                "evaluation_cache": self.evaluation_cache.to_record(),
+                "ordering_cache": self.ordering_cache.to_record(),
+                "pv": [list(self.square_to_move(square)) for square in
+                       self.principal_variation(*self.root_position, move)] if move is not None else [],
+            })
+            self.telemetry_hook(json.dumps(record))
+        return None if move is None else self.square_to_move(move)
+
+    def principal_variation(self, player_bits, opponent_bits, first_move, max_length=32):
+        """
+        Follow the transposition table's best moves from the root after first_move, stops at the first position without
+        a stored legal move (passes are skipped)
+        """
+        board = SearchBoard(player_bits, opponent_bits, self.board_size)
+        variation = [first_move]
+        board.make_move(first_move)
+        while len(variation) < max_length:
+            moves = board.get_valid_moves()
+            if not moves:
+                if not board.get_opponent_moves():
+                    break
+                board.pass_turn()
+                continue
+            entry = self.transposition_table.probe(board.board_hash)
+            if entry is None or entry[3] is None or not moves >> entry[3] & 1:
+                break
+            variation.append(entry[3])
+            board.make_move(entry[3])
+        return variation
+
+    def remember_principal_variation(self, player_bits, opponent_bits, move, score, depth):
+        """
+        Keep the principal variation of this turn's search (depth `depth`, best move `move`) for the next turn: every
+        position of it in pv_map, and the position after our move and the predicted reply as predicted_position, with
+        the variation's next move, the score, the depth its subtree was searched to and the iteration scores 2 plies
+        down (the same side is to move, so the scores carry over as they are)
+        """
+        board = SearchBoard(player_bits, opponent_bits, self.board_size)
+        self.pv_map = {}
+        self.predicted_position = None
+        for ply, square in enumerate(self.principal_variation(player_bits, opponent_bits, move)):
+            if not board.get_valid_moves():
+                board.pass_turn()  # the variation skips passes
+            if ply == 2 and board.ply == 2 and depth > 2:
+                self.predicted_position = (board.player_bits, board.opponent_bits, square, score, depth - 2,
+                                           {past_depth - 2: past_score for past_depth, past_score
+                                            in self.iteration_scores.items() if past_depth > 2})
+            self.pv_map[board.board_hash] = square
+            board.make_move(square)
+
+    def carry_over_search_state(self, player_bits, opponent_bits):
+        """
+        Age the move ordering state of the previous turn for this one: the history scores are divided by
+        2 ** HISTORY_AGING_SHIFT and the killers move up 2 plies when the root is 2 plies after the previous one (our
+        move and a reply), otherwise they are dropped. When the opponent played the predicted reply, returns
+        (move, score, depth, iteration scores) of the previous search for this position, else (None, None, 0, {})
+        """
+        self.history_table = {move: score >> HISTORY_AGING_SHIFT for move, score in self.history_table.items()
+                              if score >> HISTORY_AGING_SHIFT}
+        discs = popcount(player_bits | opponent_bits)
+        if self.previous_root_discs is not None and discs == self.previous_root_discs + 2:
+            self.killer_moves = {ply - 2: killers for ply, killers in self.killer_moves.items() if ply >= 2}
+        else:
+            self.killer_moves = {}
+        self.previous_root_discs = discs
 
-        valid_moves = get_valid_moves(chess_board, player)
-        if (np.count_nonzero(chess_board)==4) : 
-            return (valid_moves[np.random.randint(0,4)]) # make the first move random if we are playing first
-        if not valid_moves:  # Pass turn if no valid moves
-            return None
-        elif len(valid_moves) == 1:
-            return valid_moves[0]  # Only one move
+        predicted, self.predicted_position = self.predicted_position, None
+        if predicted is None or predicted[:2] != (player_bits, opponent_bits):
+            return None, None, 0, {}
+        return predicted[2:]
 
+    def iterative_deepening(self, player_bits, opponent_bits, start_depth=1, max_iterative_depth=25,
+                            iteration_scores=None):
+        """
+        Run alpha-beta with increasing depth until the time limit and return (best_move, best_score, depth) of the
+        deepest completed iteration (best_move is None if not even the first one finished)
+        With a time manager, an iteration is only started when it is predicted to finish within the turn's allocation.
+        iteration_scores ({depth: score}, e.g. carried over from the previous turn) centre the first aspiration windows,
+        the scores of this search are left in self.iteration_scores
+        """
+        manager = self.time_manager
         # Start with depth 1 and increase depth iteratively
-        depth = 1
+        depth = start_depth
         best_move = None
-        max_iterative_depth = 25
+        best_score = None
+        completed_depth = 0
+        iteration_scores = dict(iteration_scores or {})
+        self.iteration_scores = iteration_scores
 
         try:
             while depth <= max_iterative_depth:
-                if time.time() >= self.time_limit:
-                    break 
-                # IDS with alpha-beta pruning
-                current_best_move, current_best_score = self.alpha_beta_search(
-                    chess_board, player, opponent, depth
+                iteration_start = time.time()
+                if iteration_start >= self.time_limit:
+                    break
+                if manager is not None and not manager.should_start_iteration(iteration_start):
+                    break
+                # IDS with principal variation search, the window is centred on the score two iterations back
+                # since the evaluation swings by hundreds of points between odd and even depths
+                iteration_nodes = self.nodes_visited_total
+                current_best_move, current_best_score = self.aspiration_search(
+                    player_bits, opponent_bits, depth, iteration_scores.get(depth - 2)
                 )
-                # print(f"Depth {depth}, t={(2 - (self.time_limit - time.time())):.2f}, Best Move: {current_best_move}, Score: {current_best_score:2f}, Positions Evaluated: {self.leaf}, Minimax Calls: {self.nodes_visited_total}")
+                iteration_scores[depth] = current_best_score
+                if self.stats is not None:
+                    self.stats.iterations.append({
+                        "depth": depth, "nodes": self.nodes_visited_total - iteration_nodes,
+                        "seconds": time.time() - self.start_time, "best_move": current_best_move,
+                        "score": current_best_score,
+                    })
+                if manager is not None:
+                    manager.record_iteration(time.time() - iteration_start, current_best_move)
                 best_move = current_best_move
+                best_score = current_best_score
+                completed_depth = depth
                 depth += 1
         except TimeoutError:
-            pass 
+            pass
 
-        if best_move is None and valid_moves:  # go to the first valid move
-            best_move = valid_moves[0]
-        return best_move
+        return best_move, best_score, completed_depth
+
+    def parallel_search(self, player_bits, opponent_bits, start_depth=1, iteration_scores=None):
+        """
+        Lazy SMP: the helper processes and this process all run iterative deepening on the same position, sharing the
+        transposition table in shared memory, odd helpers one depth ahead so they fill the table for the others.
+        The move of the deepest completed iteration wins, this process's own result is the fallback, so a legal move
+        is always returned on time
+        """
+        if self.worker_pool is None:
+            # Workers are forked after the shared table exists so they inherit its mapping
+            self.worker_pool = ProcessPoolExecutor(self.search_workers - 1, mp_context=get_worker_context())
+        table = self.transposition_table
+        self.search_token += 1
+        table.control[0] = self.search_token
+        helpers = [
+            self.worker_pool.submit(lazy_smp_worker, table.shared_memory.name, table.size, self.board_size,
+                                    table.generation, player_bits, opponent_bits, self.optimized_weights,
+                                    start_depth + worker_index % 2, self.time_limit, self.search_token,
+                                    pattern_evaluation=self.pattern_evaluation, tuned_weights=self.tuned_weights,
+                                    probcut=self.probcut)
+            for worker_index in range(1, self.search_workers)
+        ]
 
-    def alpha_beta_search(self, chess_board, player, opponent, max_depth):
+        best_move, best_score, best_depth = self.iterative_deepening(player_bits, opponent_bits, start_depth,
+                                                                     iteration_scores=iteration_scores)
+
+        # Call the helpers off when this search stops (on the time manager's target, not only at the deadline): they
+        # stop within TIME_CHECK_INTERVAL nodes and return their deepest completed iteration
+        table.control[0] = 0
+        wait(helpers, timeout=max(min(WORKER_STOP_GRACE, self.time_limit + 0.01 - time.time()), 0))
+        for helper in helpers:
+            if not helper.done() or helper.exception() is not None:
+                continue # still stopping or crashed, ignore it
+            move, score, depth = helper.result()
+            if move is not None and depth > best_depth:
+                best_move, best_score, best_depth = move, score, depth
+        return best_move, best_score, best_depth
+
+    def mcts_search(self, player_bits, opponent_bits):
         """
-        Alpha-beta IDS
+        Monte Carlo tree search of the position until the time manager's target, the deadline less MCTS_SAFETY_MARGIN
+        or the node limit, and return (best_move, value, depth): the most visited root move, its mean result for us (1 win, 0.5 draw,
+        0 loss) and the length of the most visited line.
+        Each batch descends mcts_batch_size times from the root with the selection rule, a virtual loss on the path
+        steering the next descents of the batch elsewhere, expands the leaves with the move ordering priors, then plays
+        all the leaves out at once with batch_playouts and backs their results up. The tree is kept for the next turn.
+        A batch is only started when it is predicted to finish in time (predict_batch_seconds), halved until it is;
+        re-rooting the tree happens after the turn's clock started, so it is counted against the same deadline
         """
-        alpha = float('-inf')
-        beta = float('inf')
+        board_size = self.board_size
+        tree = self.mcts_tree
+        if tree is None or tree.board_size != board_size or not tree.advance_to(player_bits, opponent_bits):
+            tree = self.mcts_tree = MCTSTree(self.mcts_tree_nodes, board_size, player_bits, opponent_bits)
+        rule = self.mcts_selection
+        exploration = self.mcts_exploration if self.mcts_exploration is not None else MCTS_EXPLORATION[rule]
+        square_weights = None
+        if self.mcts_rollout_temperature is not None:
+            square_weights = np.exp(self.positional_weights.ravel() / self.mcts_rollout_temperature)
+        board = self.board = SearchBoard(player_bits, opponent_bits, board_size)
+        manager = self.time_manager
+        deadline = self.time_limit - MCTS_SAFETY_MARGIN
+        batch_durations = {}  # batch size -> seconds of its last batch this turn
+
+        while tree.child_counts[0] != 0:
+            batch_start = time.time()
+            if self.node_limit_reached(self.nodes_visited_total):
+                break
+            if manager is not None and batch_start - self.start_time >= manager.target():
+                break
+            batch_size = self.mcts_batch_size if batch_durations else min(self.mcts_batch_size, MCTS_FIRST_BATCH_SIZE)
+            while batch_size > 1 and batch_start + predict_batch_seconds(batch_durations, batch_size) > deadline:
+                batch_size //= 2
+            if batch_start + predict_batch_seconds(batch_durations, batch_size) > deadline:
+                break
+            paths, leaves, signs, results = [], [], [], []
+            for simulation in range(batch_size):
+                node = 0
+                path = [0]
+                tree.visits[0] += 1
+                while tree.child_counts[node] > 0:
+                    node = tree.select_child(node, rule, exploration)
+                    tree.visits[node] += 1  # virtual loss, the result is added at the end of the batch
+                    move = int(tree.moves[node])
+                    if move < 0:
+                        board.pass_turn()
+                    else:
+                        board.make_move(move)
+                    path.append(node)
+                if tree.child_counts[node] < 0:
+                    moves = board.get_valid_moves()
+                    if moves:
+                        squares = squares_of(moves)
+                        tree.expand(node, squares, self.mcts_priors(squares))
+                    elif board.get_opponent_moves():
+                        tree.expand(node, [-1], [1.0])
+                    else:
+                        tree.child_counts[node] = 0
+                # Leaf positions from the side to move's point of view, results are turned into ours with the sign
+                sign = 1 if board.maximizing_player else -1
+                mover_bits, other_bits = board.player_bits, board.opponent_bits
+                if sign < 0:
+                    mover_bits, other_bits = other_bits, mover_bits
+                if tree.child_counts[node] == 0:
+                    results.append(sign * final_disc_difference(mover_bits, other_bits,
+                                                                self.full_mask & ~(mover_bits | other_bits)))
+                else:
+                    results.append(None)
+                    leaves.append((bits_to_rows(mover_bits, board_size), bits_to_rows(other_bits, board_size)))
+                    signs.append(sign)
+                paths.append(path)
+                for step in range(len(path) - 1):
+                    board.unmake_move()
+
+            if leaves:
+                rows = np.array(leaves, dtype=np.uint16)
+                differences = iter(np.array(signs) * batch_playouts(rows[:, 0], rows[:, 1], board_size,
+                                                                    square_weights))
+                results = [next(differences) if result is None else result for result in results]
+            # Back up: a node's value is for the side that moved into it, us at odd depths
+            nodes, values = [], []
+            for path, difference in zip(paths, results):
+                win = 1.0 if difference > 0 else 0.5 if difference == 0 else 0.0
+                nodes.extend(path)
+                values.extend(win if depth & 1 else 1 - win for depth in range(len(path)))
+            np.add.at(tree.value_sums, nodes, values)
+            self.nodes_visited_total += len(paths)
+            batch_durations[batch_size] = time.time() - batch_start
+
+        if tree.child_counts[0] <= 0:
+            return None, None, 0
+        best = tree.best_child()
+        value = float(tree.value_sums[best] / max(tree.visits[best], 1))
+        return int(tree.moves[best]), value, len(tree.principal_line())
+
+    def start_pondering(self, player_bits, opponent_bits, move):
+        """
+        Predict the opponent's reply to our move from the principal variation stored in the transposition table and
+        search the resulting position in the background until the next step (or ponder time limit)
+        """
+        board = SearchBoard(player_bits, opponent_bits, self.board_size)
+        board.make_move(move)
+        if board.get_valid_moves():
+            entry = self.transposition_table.probe(board.board_hash)
+            if entry is None or entry[3] is None or not board.get_valid_moves() >> entry[3] & 1:
+                return # no principal variation reply to ponder on
+            board.make_move(entry[3])
+        else:
+            board.pass_turn() # the opponent will have to pass, we move again
+        if not board.get_valid_moves():
+            return
+
+        if self.ponder_pool is None:
+            self.ponder_pool = ProcessPoolExecutor(1, mp_context=get_worker_context())
+        table = self.transposition_table
+        self.search_token += 1
+        table.control[0] = self.search_token
+        self.ponder_position = (board.player_bits, board.opponent_bits)
+        # Stored with the next turn's generation so the entries count as fresh then
+        self.ponder_future = self.ponder_pool.submit(
+            lazy_smp_worker, table.shared_memory.name, table.size, self.board_size, (table.generation + 1) & 0xFF,
+            board.player_bits, board.opponent_bits, self.optimized_weights, 1,
+            time.time() + self.max_time_per_turn * 2, self.search_token, self.pattern_evaluation, self.tuned_weights,
+            self.probcut)
+
+    def collect_ponder_result(self, player_bits, opponent_bits):
+        """
+        Stop the background ponder search and return its (best_move, best_score, depth) if it was searching this
+        position, (None, None, 0) otherwise. A wrong prediction is dropped without waiting for the worker
+        """
+        future, position = self.ponder_future, self.ponder_position
+        self.ponder_future = self.ponder_position = None
+        if future is None:
+            return None, None, 0
+        self.transposition_table.control[0] = 0 # abort token changed, the worker stops within a few nodes
+        if position != (player_bits, opponent_bits):
+            return None, None, 0
+        try:
+            return future.result(timeout=min(WORKER_STOP_GRACE, self.max_time_per_turn * 0.05))
+        except Exception:
+            return None, None, 0
+
+    def search_aborted(self):
+        """
+        Whether this helper process's search was called off by the main process (pondering on a wrong prediction)
+        """
+        return self.abort_token is not None and self.transposition_table.control[0] != self.abort_token
+
+    def node_limit_reached(self, nodes):
+        """
+        Whether a search that visited this many nodes used up the per-move node limit (never without a limit)
+        """
+        return self.node_limit is not None and nodes >= self.node_limit
+
+    def close(self):
+        """
+        Stop the parallel search and pondering workers and release the shared transposition table
+        """
+        if self.ponder_pool is not None:
+            self.transposition_table.control[0] = 0
+            self.ponder_pool.shutdown(wait=True, cancel_futures=True)
+            self.ponder_pool = None
+            self.ponder_future = None
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown(wait=True, cancel_futures=True)
+            self.worker_pool = None
+        if self.transposition_table is not None:
+            self.transposition_table.close()
+            self.transposition_table = None
+
+    def set_board_size(self, board_size):
+        """
+        Load the positional weights and bitboard masks used by the search for this board size
+        """
+        self.board_size = board_size
+        self.geometry = get_board_geometry(board_size)
+        self.full_mask = self.geometry.full_mask
+        self.corner_mask = self.geometry.corner_mask
+        self.positional_weights = self.geometry.positional_weights
+        self.square_weights = self.positional_weights.ravel().tolist()
+        self.phase_weights = self.get_phase_weights(board_size)
+        self.probcut_cuts = MPC_PARAMETERS.get(board_size, {})
+        get_stability_tables(board_size)  # built on the first turn of a size, not mid-search
+        self.patterns = get_pattern_set(board_size) if self.pattern_evaluation else None
+        if self.transposition_table is None or self.transposition_table.board_size != board_size:
+            # A new table for a new size, with parallel search it must be shared and the workers forked again
+            if self.transposition_table is not None:
+                self.close()
+            self.transposition_table = TranspositionTable(self.transposition_table_limit, board_size,
+                                                          shared=self.search_workers > 1 or self.pondering)
+            self.clear_caches()
+            # Nothing of the previous size's search state applies to this one
+            self.killer_moves = {}
+            self.history_table = {}
+            self.pv_map = {}
+            self.previous_root_discs = None
+            self.predicted_position = None
+        elif self.evaluation_cache is None:
+            self.clear_caches()
+
+    def lookup_opening_book(self, player_bits, opponent_bits):
+        """
+        Return the opening book move for the position (us to move), or None if the book has no legal move for it
+        """
+        book = get_opening_book(self.board_size)
+        if book is None:
+            return None
+        entry = book.lookup(player_bits, opponent_bits)
+        if entry is None:
+            return None
+        move, score, depth = entry
+        if not bitboard_valid_moves(player_bits, opponent_bits, self.board_size) >> move & 1:
+            return None # corrupted or colliding entry, search instead
+        return move
+
+    def square_to_move(self, square):
+        """
+        Convert a bitboard square index back to the (row, col) move expected by the simulator
+        """
+        return divmod(square, self.board_size)
+
+    def alpha_beta_search(self, player_bits, opponent_bits, max_depth, alpha=float('-inf'), beta=float('inf')):
+        """
+        Principal variation search of the root to max_depth within the (alpha, beta) window. The previous iteration's
+        best move (stored in the transposition table) is searched first with the window, the other moves with a null
+        window. Returns (best_move, best_score); best_score is only a bound if it falls outside the window
+        """
+        original_alpha = alpha
         best_score = float('-inf')
         best_move = None
 
-        valid_moves = get_valid_moves(chess_board, player)
-        ordered_moves = self.order_moves(chess_board, valid_moves, player, 0)
+        # One mutable board for the whole search, children are visited with make/unmake
+        self.board = SearchBoard(player_bits, opponent_bits, self.board_size, patterns=self.patterns)
+        board_hash = self.board.board_hash
+        entry = self.transposition_table.probe(board_hash)
+        valid_moves = squares_of(self.board.get_valid_moves())
+        hash_move = entry[3] if entry is not None else self.pv_map.get(board_hash)
+        ordered_moves = self.order_moves(valid_moves, 0, hash_move)
 
-        for move in ordered_moves:
+        for index, move in enumerate(ordered_moves):
             self.nodes_visited_for_move = 0
             if time.time() >= self.time_limit:
-                raise TimeoutError 
+                raise TimeoutError
 
-            new_board = chess_board.copy()
-            new_board = self.make_move(new_board, move, player)
-            score = self.minimax(new_board, max_depth - 1, False, player, opponent, alpha, beta, 1, max_depth)
+            self.board.make_move(move)
+            if index == 0:
+                score = -self.negamax(max_depth - 1, -beta, -alpha, 1)
+            else:
+                score = -self.negamax(max_depth - 1, -alpha - NULL_WINDOW, -alpha, 1)
+                if alpha < score < beta:
+                    score = -self.negamax(max_depth - 1, -beta, -alpha, 1)
+            self.board.unmake_move()
             if score > best_score:
                 best_score = score
                 best_move = move
             alpha = max(alpha, best_score)
+            if alpha >= beta:
+                break
 
+        self.store_in_transposition_table(board_hash, best_score, max_depth, original_alpha, beta, best_move)
         return best_move, best_score
 
-    def minimax(self, board, depth, maximizing_player, player, opponent, alpha, beta, current_depth, max_depth):
+    def aspiration_search(self, player_bits, opponent_bits, max_depth, previous_score):
+        """
+        Root search in a window centred on the expected score (from a previous iteration), searched again with a wider
+        window on that side when the score falls outside it. Returns (best_move, best_score)
+        """
+        if previous_score is None:
+            return self.alpha_beta_search(player_bits, opponent_bits, max_depth)
+        window = ASPIRATION_WINDOW
+        alpha = previous_score - window
+        beta = previous_score + window
+        while True:
+            best_move, best_score = self.alpha_beta_search(player_bits, opponent_bits, max_depth, alpha, beta)
+            window *= 2
+            if best_score <= alpha:
+                alpha = best_score - window  # fail low, every move is worse than expected
+            elif best_score >= beta:
+                beta = best_score + window  # fail high, the move found is better than expected
+            else:
+                return best_move, best_score
+
+    def negamax(self, depth, alpha, beta, current_depth):
+        """
+        Principal variation search of the current position of self.board, the score is from the point of view of the
+        side to move. The first move (the transposition table's best move, i.e. the previous principal variation, when
+        there is one) gets the (alpha, beta) window, the others a null window, and are only searched again with the
+        full window when they turn out better than alpha
+        """
         self.nodes_visited_total += 1
         self.nodes_visited_for_move += 1
 
-        if time.time() >= self.time_limit:
-            raise TimeoutError  # Time limit exceeded
+        # The clock (and the background search's abort token) is only looked at every TIME_CHECK_INTERVAL nodes
+        if self.nodes_visited_total & (TIME_CHECK_INTERVAL - 1) == 0:
+            if (time.time() >= self.time_limit or self.search_aborted()
+                    or self.node_limit_reached(self.nodes_visited_total)):
+                raise TimeoutError  # Time limit exceeded
+
+        board = self.board
+        stats = self.stats
+        if stats is not None:
+            stats.nodes_per_depth[current_depth] += 1
 
         # Terminal condition
-        if depth == 0 or np.count_nonzero(board == 0) == 0:
-            score = self.evaluate_board(board, player, opponent)
-            # Debug print to monitor evaluation scores
-            # print(f"Depth {current_depth}, Evaluated Score: {score}")
+        if depth == 0 or (board.player_bits | board.opponent_bits) == self.full_mask:
+            if stats is None:
+                score = self.evaluate_board(board)
+            else:
+                start = time.perf_counter()
+                score = self.evaluate_board(board)
+                stats.evaluation_seconds += time.perf_counter() - start
+                stats.leaves_per_depth[current_depth] += 1
             self.leaf += 1
-            return score
-
-        board_hash = self.hash_board(board)
-        if board_hash in self.transposition_table:
-            stored_score, stored_depth = self.transposition_table[board_hash]
+            return score if board.maximizing_player else -score
+
+        # Use the stored bound if it is deep enough, otherwise just its best move for ordering
+        board_hash = board.board_hash
+        original_alpha, original_beta = alpha, beta
+        hash_move = None
+        entry = self.transposition_table.probe(board_hash)
+        if stats is not None:
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        if entry is not None:
+            stored_score, stored_depth, stored_flag, hash_move = entry
             if stored_depth >= depth:
-                return stored_score
-
-        valid_moves = get_valid_moves(board, player if maximizing_player else opponent)
+                if stored_flag == EXACT:
+                    if stats is not None:
+                        stats.tt_cutoffs += 1
+                    return stored_score
+                elif stored_flag == LOWER_BOUND:
+                    alpha = max(alpha, stored_score)
+                else:
+                    beta = min(beta, stored_score)
+                if beta <= alpha:
+                    if stats is not None:
+                        stats.tt_cutoffs += 1
+                    return stored_score
+        if hash_move is None:
+            hash_move = self.pv_map.get(board_hash)  # the previous turn's principal variation, if its entry was lost
+
+        # Multi-ProbCut: shallow searches predict this depth's score, from the cheapest. When the prediction is above
+        # beta (or below alpha) by more than threshold standard deviations of its error, the node is cut.
+        # The intercepts are fitted with us to move and the evaluation is not antisymmetric (potential mobility and the
+        # forcing move bonus are ours only), so with the opponent to move the offset is the other way round
+        if self.probcut and depth in self.probcut_cuts and alpha > float('-inf') and beta < float('inf'):
+            threshold = self.probcut_threshold
+            for shallow_depth, slope, intercept, sigma in self.probcut_cuts[depth]:
+                if not board.maximizing_player:
+                    intercept = -intercept
+                bound = (beta + threshold * sigma - intercept) / slope
+                if self.negamax(shallow_depth, bound - NULL_WINDOW, bound, current_depth) >= bound:
+                    if stats is not None:
+                        stats.probcut_cutoffs += 1
+                    return beta
+                bound = (alpha - threshold * sigma - intercept) / slope
+                if self.negamax(shallow_depth, bound, bound + NULL_WINDOW, current_depth) <= bound:
+                    if stats is not None:
+                        stats.probcut_cutoffs += 1
+                    return alpha
+
+        if stats is None:
+            valid_moves = self.cached_valid_moves(board)
+        else:
+            start = time.perf_counter()
+            valid_moves = self.cached_valid_moves(board)
+            stats.move_generation_seconds += time.perf_counter() - start
 
         if not valid_moves:
             # Check if the opponent also has no moves
-            opponent_moves = get_valid_moves(board, opponent if maximizing_player else player)
-            if not opponent_moves:
-                score = self.evaluate_board(board, player, opponent)
-                # print(f"Depth {current_depth}, Evaluated Score (No Moves for Both): {score}")
-                return score
+            if not board.get_opponent_moves():
+                score = self.evaluate_board(board)
+                if stats is not None:
+                    stats.leaves_per_depth[current_depth] += 1
+                return score if board.maximizing_player else -score
             else:
                 # Pass turn to the opponent without decrementing depth
-                return self.minimax(board, depth, not maximizing_player, player, opponent, alpha, beta, current_depth + 1, max_depth)
-
-        if maximizing_player:
-            max_eval = float('-inf')
-            ordered_moves = self.order_moves(board, valid_moves, player, current_depth)
-            for move in ordered_moves:
-                new_board = board.copy()
-                new_board = self.make_move(new_board, move, player)
-                eval = self.minimax(new_board, depth - 1, False, player, opponent, alpha, beta, current_depth + 1, max_depth)
-                if eval > max_eval:
-                    max_eval = eval
-                    self.update_history_table(move, depth)
-                alpha = max(alpha, eval)
-                if beta <= alpha:
-                    self.record_killer_move(current_depth, move)
-                    break
-            self.store_in_transposition_table(board_hash, max_eval, depth)
-            return max_eval
+                board.pass_turn()
+                score = -self.negamax(depth, -beta, -alpha, current_depth + 1)
+                board.unmake_move()
+                return score
+
+        if stats is None:
+            ordered_moves = self.order_moves(squares_of(valid_moves), current_depth, hash_move)
         else:
-            min_eval = float('inf')
-            ordered_moves = self.order_moves(board, valid_moves, opponent, current_depth)
-            for move in ordered_moves:
-                new_board = board.copy()
-                new_board = self.make_move(new_board, move, opponent)
-                eval = self.minimax(new_board, depth - 1, True, player, opponent, alpha, beta, current_depth + 1, max_depth)
-                if eval < min_eval:
-                    min_eval = eval
-                    self.update_history_table(move, depth) 
-                beta = min(beta, eval)
-                if beta <= alpha:
-                    self.record_killer_move(current_depth, move)
-                    break
-            self.store_in_transposition_table(board_hash, min_eval, depth)
-            return min_eval
-
-    def make_move(self, board, move, player):
-        """
-        Execute the move and return the new board
-        """
-        flips = self.get_flipped_positions(board, move, player)
-        board[move] = player
-        for pos in flips:
-            board[pos] = player
-        return board
-
-    def get_flipped_positions(self, board, move, player):
-        """
-        Get the list of positions that would be flipped if the player makes the move
-        """
-        opponent = 3 - player  # player values are 1 and 2
-        flips = []
-        board_size = board.shape[0]
-
-        for direction in get_directions():
-            dx, dy = direction
-            r, c = move
-            r += dx
-            c += dy
-            discs_to_flip = []
-            while 0 <= r < board_size and 0 <= c < board_size and board[r, c] == opponent:
-                discs_to_flip.append((r, c))
-                r += dx
-                c += dy
-            if 0 <= r < board_size and 0 <= c < board_size and board[r, c] == player:
-                flips.extend(discs_to_flip)
-        return flips
- 
-    def order_moves(self, board, moves, player, current_depth):
+            start = time.perf_counter()
+            ordered_moves = self.order_moves(squares_of(valid_moves), current_depth, hash_move)
+            stats.ordering_seconds += time.perf_counter() - start
+
+        best_score = float('-inf')
+        best_move = None
+        for index, move in enumerate(ordered_moves):
+            board.make_move(move)
+            if index == 0:
+                score = -self.negamax(depth - 1, -beta, -alpha, current_depth + 1)
+            else:
+                score = -self.negamax(depth - 1, -alpha - NULL_WINDOW, -alpha, current_depth + 1)
+                if alpha < score < beta:
+                    score = -self.negamax(depth - 1, -beta, -alpha, current_depth + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                self.update_history_table(move, depth)
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                self.record_killer_move(current_depth, move)
+                if stats is not None:
+                    stats.cutoff_move_index[index] += 1
+                break
+        self.store_in_transposition_table(board_hash, best_score, depth, original_alpha, original_beta, best_move)
+        return best_score
+
+    def solve_endgame(self, player_bits, opponent_bits):
         """
-        Order moves using killer move, history heuristic, positional weights, and discs flipped
+        Solve the position exactly (perfect play) and return (best_move, score)
+        The score is the final disc difference in "exact" mode and its sign (1 win, 0 draw, -1 loss) in "wld" mode
         """
-        board_size = board.shape[0]
-        move_scores = []
+        board_size = self.board_size
+        self.time_limit = self.start_time + self.max_time_per_turn * self.endgame_time_fraction
+        self.endgame_nodes = 0
+        self.parity_regions = self.geometry.parity_regions
 
-        for move in moves:
-            if not (0 <= move[0] < board_size and 0 <= move[1] < board_size):
-                continue  
+        if self.endgame_mode == "wld":
+            alpha, beta = -1, 1
+        else:
+            alpha, beta = -board_size * board_size - 1, board_size * board_size + 1
 
-            new_board = board.copy()
-            new_board = self.make_move(new_board, move, player)
+        # Below every final score, so the first move is kept even when every move loses (fail-soft scores of a lost
+        # position fall under the wld window)
+        best_move = None
+        best_score = -board_size * board_size - 1
+        empty_bits = self.full_mask & ~(player_bits | opponent_bits)
+        moves = bitboard_valid_moves(player_bits, opponent_bits, board_size)
+        for move in self.order_endgame_moves(player_bits, opponent_bits, moves, empty_bits):
+            flips = bitboard_flips(player_bits, opponent_bits, move, board_size)
+            score = -self.endgame_search(opponent_bits & ~flips, player_bits | (1 << move) | flips,
+                                         empty_bits ^ (1 << move), -beta, -alpha, False)
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break # already a win in wld mode
+
+        if self.endgame_mode == "wld":
+            best_score = (best_score > 0) - (best_score < 0)
+        return best_move, best_score
+
+    def endgame_search(self, mover_bits, other_bits, empty_bits, alpha, beta, passed):
+        """
+        Negamax exact search from the mover's point of view, returns the final disc difference (fail-soft)
+        """
+        self.endgame_nodes += 1
+        if self.endgame_nodes & 1023 == 0 and (time.time() >= self.time_limit or
+                                               self.node_limit_reached(self.endgame_nodes)):
+            raise TimeoutError
+
+        if popcount(empty_bits) <= 4:
+            return self.endgame_search_last(mover_bits, other_bits, empty_bits, alpha, beta, passed)
+
+        moves = bitboard_valid_moves(mover_bits, other_bits, self.board_size)
+        if not moves:
+            if passed:
+                return final_disc_difference(mover_bits, other_bits, empty_bits)
+            return -self.endgame_search(other_bits, mover_bits, empty_bits, -beta, -alpha, True)
+
+        best_score = -self.board_size * self.board_size - 1
+        for move in self.order_endgame_moves(mover_bits, other_bits, moves, empty_bits):
+            flips = bitboard_flips(mover_bits, other_bits, move, self.board_size)
+            score = -self.endgame_search(other_bits & ~flips, mover_bits | (1 << move) | flips,
+                                         empty_bits ^ (1 << move), -beta, -alpha, False)
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def endgame_search_last(self, mover_bits, other_bits, empty_bits, alpha, beta, passed):
+        """
+        Lightweight exact search for the last 1-4 empties: no move generation or ordering,
+        each empty square is tried directly and it is legal if it flips something
+        """
+        board_size = self.board_size
+        best_score = None
+        squares = squares_of(empty_bits)
+        if len(squares) > 1:
+            # odd parity regions first, a cheap and good ordering this close to the end
+            regions = self.parity_regions
+            squares.sort(key=lambda square: -(popcount(empty_bits & regions[square]) & 1))
+
+        for square in squares:
+            flips = bitboard_flips(mover_bits, other_bits, square, board_size)
+            if not flips:
+                continue
+            remaining = empty_bits ^ (1 << square)
+            new_other = other_bits & ~flips
+            new_mover = mover_bits | (1 << square) | flips
+            if remaining:
+                self.endgame_nodes += 1
+                score = -self.endgame_search_last(new_other, new_mover, remaining, -beta, -alpha, False)
+            else:
+                score = popcount(new_mover) - popcount(new_other)
+            if best_score is None or score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        return best_score
+
+        if best_score is None:
+            if passed:
+                return final_disc_difference(mover_bits, other_bits, empty_bits)
+            return -self.endgame_search_last(other_bits, mover_bits, empty_bits, -beta, -alpha, True)
+        return best_score
+
+    def order_endgame_moves(self, mover_bits, other_bits, moves, empty_bits):
+        """
+        Order endgame moves: moves in regions with an odd number of empties first (parity),
+        then fastest-first (fewest opponent replies) while enough empties are left for it to pay off
+        """
+        regions = self.parity_regions
+        squares = squares_of(moves)
+        if popcount(empty_bits) <= 6:
+            squares.sort(key=lambda square: -(popcount(empty_bits & regions[square]) & 1))
+            return squares
+
+        board_size = self.board_size
+        move_scores = []
+        for move in squares:
+            flips = bitboard_flips(mover_bits, other_bits, move, board_size)
+            replies = popcount(bitboard_valid_moves(other_bits & ~flips, mover_bits | (1 << move) | flips, board_size))
+            odd_region = popcount(empty_bits & regions[move]) & 1
+            corner = self.corner_mask >> move & 1
+            move_scores.append((replies * 4 - odd_region - 2 * corner, move))
+        move_scores.sort()
+        return [move for score, move in move_scores]
+
+    def order_moves(self, moves, current_depth, hash_move=None):
+        """
+        Order the moves of the side to move on self.board using the transposition table move, killer move,
+        history heuristic, positional weights, and discs flipped
+        The scores that only depend on the position are cached, the killer and history terms are added on each call
+        """
+        static_scores = self.cached_static_move_scores(moves)
+        move_scores = []
+        killers = self.killer_moves.get(current_depth, [])
+        history_table = self.history_table
+        for move in moves:
+            score = static_scores[move]
+            # Best move stored in the transposition table for this position is always searched first
+            if move == hash_move:
+                score += 100000
 
-            score = 0
             # Killer move heuristic
-            if move in self.killer_moves.get(current_depth, []):
+            if move in killers:
                 score += 1000  # prioritize killer moves
-            
-            # Corner heuristic
-            corners = [(0, 0), (0, board_size - 1), (board_size - 1, 0), (board_size - 1, board_size - 1)]
-            if move in corners:
-                score += 1000
-
-            # Stability Heuristic
-            stability_score = self.calculate_stability(new_board, player)
-            score += stability_score * 20  # Weight for stability in ordering
 
             # History heuristic
             # prioritizes moves that have been successful in improving evaluations during other searches
             # history table keeps track of these moves and assigns higher scores to frequently beneficial ones
-            score += 20 *self.history_table.get(move, 0)
-
-            # Positional weights heuristic
-            positional_weight = self.positional_weights[move[0]][move[1]]
-            score += positional_weight * 10 
-
-            # Number of discs flipped heuristic
-            num_discs_flipped = count_capture(board, move, player)
-            score += num_discs_flipped * 5 
+            score += 20 * history_table.get(move, 0)
 
             move_scores.append((score, move))
 
@@ -288,6 +1018,66 @@ class StudentAgent(Agent):
         ordered_moves = [move for score, move in move_scores]
         return ordered_moves
 
+    def cached_static_move_scores(self, moves):
+        """
+        static_move_scores of the position on self.board, from the ordering cache when it has them
+        """
+        board_hash = self.board.board_hash
+        static_scores = self.ordering_cache.get(board_hash)
+        if static_scores is None or len(static_scores) != len(moves):
+            static_scores = self.static_move_scores(moves)
+            self.ordering_cache.put(board_hash, static_scores)
+        return static_scores
+
+    def static_move_scores(self, moves):
+        """
+        Ordering scores of the moves of the side to move on self.board that only depend on the position, as
+        {move: score}: corners, the mover's stable edge discs after the move, positional weights and discs flipped
+        """
+        static_scores = {}
+        board = self.board
+        player_bits, opponent_bits = board.player_bits, board.opponent_bits
+        mover_index = 0 if board.maximizing_player else 1
+        stability_tables = get_stability_tables(self.board_size)
+
+        for move in moves:
+            # The child position is only built as bitboards, no need to play the move on the board
+            flips = board.get_flipped_positions(move)
+            if mover_index == 0:
+                child_player_bits, child_opponent_bits = player_bits | (1 << move) | flips, opponent_bits ^ flips
+            else:
+                child_player_bits, child_opponent_bits = player_bits ^ flips, opponent_bits | (1 << move) | flips
+
+            score = 0
+            # Corner heuristic
+            if self.corner_mask >> move & 1:
+                score += 1000
+
+            # Stability Heuristic: the mover's stable edge discs, the full analysis is left to the evaluation
+            edge_stable = stability_tables.edge_stable(child_player_bits, child_opponent_bits)
+            stability_score = popcount(edge_stable[mover_index])
+            score += stability_score * 20  # Weight for stability in ordering
+
+            # Positional weights heuristic
+            positional_weight = self.square_weights[move]
+            score += positional_weight * 10
+
+            # Number of discs flipped heuristic
+            num_discs_flipped = popcount(flips)
+            score += num_discs_flipped * 5
+
+            static_scores[move] = score
+        return static_scores
+
+    def mcts_priors(self, moves):
+        """
+        MCTS priors of the moves of the side to move on self.board: a softmax of their static ordering scores
+        """
+        static_scores = self.cached_static_move_scores(moves)
+        scores = np.array([static_scores[move] for move in moves], dtype=np.float64) / MCTS_PRIOR_TEMPERATURE
+        priors = np.exp(scores - scores.max())
+        return priors / priors.sum()
+
     def record_killer_move(self, depth, move):
         """
         Record a killer move for a specific depth. We keep up to 2 killer moves per depth
@@ -312,9 +1102,23 @@ class StudentAgent(Agent):
             self.history_table.pop(next(iter(self.history_table)))
         self.history_table[move] = self.history_table.get(move, 0) + 2 ** depth
 
-    def evaluate_board(self, board, player, opponent):
+    def get_phase_weights(self, board_size):
         """
-        Evaluate the board based on game state and different heuristics
+        Build the weights of the 8 heuristics for each game phase (0: early, 7: mid, 14: late), including the board size tunings
+        """
+        if board_size in self.tuned_weights:
+            return dict(self.tuned_weights[board_size])
+        adjustments = get_board_geometry(board_size).weight_adjustments
+        phase_weights = {}
+        for weight_index, weight_potential_mobility in ((0, 7), (7, 5), (14, 2)): # (maybe change early to 10)
+            weights = list(self.optimized_weights[weight_index:weight_index + 7]) + [weight_potential_mobility]
+            phase_weights[weight_index] = tuple(weight + adjustment
+                                                for weight, adjustment in zip(weights, adjustments[weight_index]))
+        return phase_weights
+
+    def evaluate_board(self, board):
+        """
+        Evaluate a SearchBoard based on game state and different heuristics
         1. pieces: Measures the difference in the number of pieces each player controls, favoring boards where the player has more pieces
         2. corners: Rewards occupying corner positions, as they are stable and cannot be flipped once captured
         3. mobility: Evaluates the player's ability to make moves compared to the opponent, prioritizing higher mobility to retain control
@@ -323,78 +1127,58 @@ class StudentAgent(Agent):
         6. parity: Accounts for the parity of empty squares, favoring configurations that lead to favorable turn order in the endgame
         7. position: Rewards control of strategically valuable positions based on a weighted positional matrix
         8. potential mobility: Considers the player's ability to increase future mobility by limiting the opponent's potential moves
+        Disc counts, positional score, frontier counts and game phase come from the board's incremental EvaluationState
+        With pattern evaluation on, the pattern tables replace all of these
         """
-        # Determine game phase
-        weight_potential_mobility = 0
-        total_discs = np.count_nonzero(board)
-        board_size = board.shape[0]
-        total_squares = board_size * board_size
-        if total_discs <= total_squares * 0.25: # early game
-            weight_index = 0
-            weight_potential_mobility = 7 # (maybe change to 10)
-        elif total_discs <= total_squares * 0.75: # middle game
-            weight_index = 7
-            weight_potential_mobility = 5
-        else: # end game
-            weight_index = 14
-            weight_potential_mobility = 2
-
-        # Extract weights for the current game phase
-        weights = self.optimized_weights[weight_index:weight_index + 7]
-        (weight_pieces, weight_corners, weight_mobility, weight_stability,
-         weight_frontier, weight_parity, weight_position) = weights
-        
-        if (board_size == 6):
-            if (weight_index <= 7):
-                weight_mobility += 15
-            weight_corners += 30 # corners and edges are crucial on 6x6 board
-            weight_stability += 10
-        elif (board_size == 8):
-            # add any 8x8 specific tunings here
-            pass
-        elif (board_size == 10):
-            weight_potential_mobility += 5 # keeping options on larger boards is more important than smaller ones
-        elif (board_size ==12):
-            weight_potential_mobility += 5 # keeping options on larger boards is more important than smaller ones
-            weight_frontier -= 5 # penalize frontiers even more on large boards
+        if self.patterns is not None:
+            return self.evaluate_patterns(board)
+        # The evaluation only depends on the discs (not on the side to move), a repeated leaf is a cache lookup
+        disc_hash = board.disc_hash()
+        cached = self.evaluation_cache.get(disc_hash)
+        if cached is not None:
+            return cached[0]
+        state = board.evaluation
+        player_bits = board.player_bits
+        opponent_bits = board.opponent_bits
+        board_size = self.board_size
+
+        # Weights for the current game phase
+        (weight_pieces, weight_corners, weight_mobility, weight_stability, weight_frontier,
+         weight_parity, weight_position, weight_potential_mobility) = self.phase_weights[state.phase_index]
 
         # Piece difference
-        player_pieces = np.count_nonzero(board == player)
-        opponent_pieces = np.count_nonzero(board == opponent)
-        piece_diff = player_pieces - opponent_pieces
+        piece_diff = state.player_count - state.opponent_count
 
         # Corner occupancy
-        corners = [(0, 0), (0, board_size - 1), (board_size - 1, 0), (board_size - 1, board_size - 1)]
-        player_corners = sum(1 for corner in corners if board[corner] == player)
-        opponent_corners = sum(1 for corner in corners if board[corner] == opponent)
-        corner_diff = player_corners - opponent_corners
+        corner_diff = popcount(player_bits & self.corner_mask) - popcount(opponent_bits & self.corner_mask)
 
         # Mobility
-        player_moves = len(get_valid_moves(board, player))
-        opponent_moves = len(get_valid_moves(board, opponent))
+        player_moves_mask = bitboard_valid_moves(player_bits, opponent_bits, board_size)
+        opponent_moves_mask = bitboard_valid_moves(opponent_bits, player_bits, board_size)
+        player_moves = popcount(player_moves_mask)
+        opponent_moves = popcount(opponent_moves_mask)
         if player_moves + opponent_moves != 0:
             mobility = 100 * (player_moves - opponent_moves) / (player_moves + opponent_moves)
         else:
             mobility = 0
 
         # Frontier Discs
-        player_frontier_discs = self.count_frontier_discs(board, player)
-        opponent_frontier_discs = self.count_frontier_discs(board, opponent)
-        frontier_diff = player_frontier_discs - opponent_frontier_discs
+        frontier_diff = state.player_frontier - state.opponent_frontier
 
         # Parity
-        empty_squares = total_squares - total_discs
+        empty_squares = board_size * board_size - state.player_count - state.opponent_count
         parity = 1 if empty_squares % 2 == 0 else -1
 
         # Positional score
-        positional_score = np.sum(self.positional_weights * (board == player)) - \
-                           np.sum(self.positional_weights * (board == opponent))
+        positional_score = state.positional_score
 
         # Potential Mobility
-        potential_mobility = self.calculate_potential_mobility(board, player, opponent)
+        empty_bits = self.full_mask & ~(player_bits | opponent_bits)
+        potential_mobility = self.calculate_potential_mobility(empty_bits, opponent_bits)
 
         # Stability
-        stability = self.calculate_stability(board, player) - self.calculate_stability(board, opponent)
+        player_stable, opponent_stable = bitboard_stability(player_bits, opponent_bits, board_size)
+        stability = popcount(player_stable) - popcount(opponent_stable)
 
         # Total evaluation
         score = (
@@ -412,105 +1196,192 @@ class StudentAgent(Agent):
         if opponent_moves==0:
             score += 1000 # can tune
 
+        self.evaluation_cache.put(disc_hash, (score, player_moves_mask, opponent_moves_mask))
         return score
 
-    def count_frontier_discs(self, board, player):
+    def evaluate_patterns(self, board):
         """
-        Count the number of frontier discs
+        Evaluate a SearchBoard with the pattern tables, from our point of view: the sum of the values of the pattern
+        instances (their indices are kept up to date by the EvaluationState) plus the tempo of the side to move
         """
-        frontier_discs = 0
-        board_size = board.shape[0]
-        directions = get_directions()
-
-        for i in range(board_size):
-            for j in range(board_size):
-                if board[i, j] == player:
-                    for dx, dy in directions:
-                        ni, nj = i + dx, j + dy
-                        if 0 <= ni < board_size and 0 <= nj < board_size:
-                            if board[ni, nj] == 0:
-                                frontier_discs += 1
-                                break  # Count each disc only once
-        return frontier_discs
-
-    def calculate_potential_mobility(self, board, player, opponent):
+        state = board.evaluation
+        patterns = self.patterns
+        phase = patterns.phase_of[state.player_count + state.opponent_count]
+        score = float(patterns.tables[phase].take(state.pattern_indices).sum())
+        tempo = float(patterns.tempo[phase])
+        return score + tempo if board.maximizing_player else score - tempo
+
+    def evaluate_boards(self, boards, player, opponent):
         """
-        Calculate potential mobility for the player
+        Evaluate a stack of numpy boards with shape (N, n, n) in one vectorized pass, returning N scores
+        Gives the same scores as evaluate_board, e.g. for all the children of a node or a batch of analysis positions
+        (with pattern evaluation, player is taken to be the side to move)
         """
-        potential_mobility = 0
-        board_size = board.shape[0]
-        directions = get_directions()
-
-        for i in range(board_size):
-            for j in range(board_size):
-                if board[i, j] == 0:
-                    for dx, dy in directions:
-                        ni, nj = i + dx, j + dy
-                        if 0 <= ni < board_size and 0 <= nj < board_size:
-                            if board[ni, nj] == opponent:
-                                potential_mobility += 1
-                                break
-        return potential_mobility
-
-    def calculate_stability(self, board, player):
+        if self.patterns is not None:
+            boards = np.asarray(boards)
+            patterns = self.patterns
+            indices = batch_pattern_indices(boards, player, opponent, patterns)
+            discs = (boards != 0).sum(axis=(1, 2))
+            phases = np.array(patterns.phase_of)[discs]
+            return patterns.tables[phases[:, np.newaxis], indices].sum(axis=1) + patterns.tempo[phases]
+        features, phase_indices, opponent_blocked = batch_features(boards, player, opponent)
+        phase_weights = self.get_phase_weights(boards.shape[1])
+        weights = np.array([phase_weights[weight_index] for weight_index in (0, 7, 14)], dtype=np.float64)
+        scores = np.einsum('ij,ij->i', features, weights[phase_indices // 7])
+        return scores + 1000 * opponent_blocked # forcing move heuristic, same as evaluate_board
+
+    def calculate_potential_mobility(self, empty_bits, opponent_bits):
         """
-        Calculate the stability of the player's discs
+        Calculate potential mobility for the player (empty squares touching at least one opponent disc)
         """
-        board_size = board.shape[0]
-        stability_matrix = np.zeros((board_size, board_size), dtype=bool)
-        stable_discs = 0
-
-        # Directions
-        directions = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+        return popcount(empty_bits & bitboard_neighbours(opponent_bits, self.board_size))
 
-        # Corners
-        corners = [(0, 0), (0, board_size - 1), (board_size - 1, 0), (board_size - 1, board_size - 1)]
-
-        # Check stability starting from corners
-        for corner in corners:
-            if board[corner] == player:
-                self.mark_stable_discs(board, stability_matrix, corner, player, directions)
+    def cached_valid_moves(self, board):
+        """
+        Mask of legal moves for the side to move on the board, taken from the evaluation cache when the position was
+        evaluated before (the leaves of one iteration are the inner nodes of the next)
+        """
+        cached = self.evaluation_cache.get(board.disc_hash())
+        if cached is None:
+            return board.get_valid_moves()
+        return cached[1] if board.maximizing_player else cached[2]
 
-        stable_discs = np.count_nonzero(stability_matrix)
-        return stable_discs
+    def clear_caches(self):
+        """
+        Allocate empty evaluation and move ordering caches with the configured memory budgets (needed after changing
+        the evaluation weights, the cached scores would be stale)
+        """
+        self.evaluation_cache = BoundedCache(self.evaluation_cache_bytes, EVALUATION_CACHE_ENTRY_BYTES)
+        self.ordering_cache = BoundedCache(self.ordering_cache_bytes, ORDERING_CACHE_ENTRY_BYTES)
 
-    def mark_stable_discs(self, board, stability_matrix, position, player, directions):
+    def store_in_transposition_table(self, board_hash, value, depth, alpha, beta, best_move):
         """
-        Mark stable discs starting from a given position
+        Store a value in the transposition table, flagged as a bound if it came from an alpha-beta cutoff
         """
-        stack = [position]
-        board_size = board.shape[0]
-        while stack:
-            x, y = stack.pop()
-            stability_matrix[x, y] = True
-            for dx, dy in directions:
-                nx, ny = x + dx, y + dy
-                if (0 <= nx < board_size) and (0 <= ny < board_size):
-                    if not stability_matrix[nx, ny] and board[nx, ny] == player:
-                        stability_matrix[nx, ny] = True
-                        stack.append((nx, ny))
+        if value <= alpha:
+            flag = UPPER_BOUND  # every move failed low, the real value is at most this
+        elif value >= beta:
+            flag = LOWER_BOUND  # cutoff, the real value is at least this
+        else:
+            flag = EXACT
+        self.transposition_table.store(board_hash, value, depth, flag, best_move)
 
-    def hash_board(self, board):
+class SearchStatistics:
+    """
+    Statistics of one step's search, only collected when the agent has a telemetry hook
+    """
+    def __init__(self):
+        self.nodes_per_depth = defaultdict(int)  # ply from the root -> nodes
+        self.leaves_per_depth = defaultdict(int)
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.probcut_cutoffs = 0
+        self.cutoff_move_index = defaultdict(int)  # position in the ordered move list -> beta cutoffs, ordering quality
+        self.move_generation_seconds = 0.0
+        self.ordering_seconds = 0.0
+        self.evaluation_seconds = 0.0
+        self.iterations = []  # one entry per completed iterative deepening depth
+
+    def effective_branching_factor(self):
         """
-        Create hashable representation of the board
+        Ratio of the nodes of the last two completed iterations (None with fewer than two)
         """
-        # Use an immutable representation to prevent issues with in-place modifications
-        return tuple(map(tuple, board))
+        if len(self.iterations) < 2 or not self.iterations[-2]["nodes"]:
+            return None
+        return self.iterations[-1]["nodes"] / self.iterations[-2]["nodes"]
 
-    def store_in_transposition_table(self, board_hash, value, depth):
+    def to_record(self):
         """
-        Store a value in the transposition table with size limit
+        JSON-serializable dict of the statistics
         """
-        if board_hash in self.transposition_table:
-            stored_value, stored_depth = self.transposition_table[board_hash]
-            if stored_depth >= depth:
-                return  # Do not overwrite an entry with a higher or equal depth
-        self.transposition_table[board_hash] = (value, depth)
-        self.transposition_table_keys.append(board_hash)
-        if len(self.transposition_table_keys) > self.transposition_table_limit:
-            # Remove oldest item
-            oldest_key = self.transposition_table_keys.pop(0)
-            del self.transposition_table[oldest_key]
+        def as_list(counts):
+            return [counts.get(index, 0) for index in range(max(counts) + 1)] if counts else []
+        return {
+            "nodes_per_depth": as_list(self.nodes_per_depth),
+            "leaves_per_depth": as_list(self.leaves_per_depth),
+            "tt": {"probes": self.tt_probes, "hits": self.tt_hits, "cutoffs": self.tt_cutoffs},
+            "cutoff_move_index": as_list(self.cutoff_move_index),
+            "probcut_cutoffs": self.probcut_cutoffs,
+            "effective_branching_factor": self.effective_branching_factor(),
+            "time": {"move_generation": self.move_generation_seconds, "ordering": self.ordering_seconds,
+                     "evaluation": self.evaluation_seconds},
+            "iterations": self.iterations,
+        }
+
+def jsonl_file_hook(path):
+    """
+    Telemetry hook appending each record as one line of a JSON-lines file
+    """
+    def write_record(line):
+        with open(path, "a") as telemetry_file:
+            telemetry_file.write(line + "\n")
+    return write_record
+
+# Nodes between two looks at the clock in negamax (a power of two), 3 to 5ms at the measured 12k to 20k nodes per
+# second of the benchmark's search (the look itself costs well under a microsecond)
+TIME_CHECK_INTERVAL = 64
+# Share of the turn after which no new iteration is started, by game phase: (fraction of the board filled up to, share)
+TIME_TARGETS = [(0.3, 0.8), (0.8, 1.0), (1.0, 0.9)]
+# Allocation multipliers when the best move stayed the same for TIME_STABLE_ITERATIONS iterations, or just changed
+TIME_STABLE_ITERATIONS = 3
+TIME_STABLE_FACTOR = 0.7
+TIME_UNSTABLE_FACTOR = 1.3
+# Iteration times vary a lot around the prediction (half of it or less about a quarter of the time), so an iteration
+# is only skipped when even this fraction of its predicted duration does not fit before the deadline
+TIME_PREDICTION_CONFIDENCE = 0.5
+
+class TimeManager:
+    """
+    Time allocation of one turn for iterative deepening. The hard deadline aborts the search, the soft target only
+    decides whether another iteration is started: it depends on the game phase, is cut when the best move is stable
+    and extended when it just changed. An iteration is also skipped when the effective branching factor of the
+    previous ones predicts that it cannot finish before the deadline, rather than being thrown away half done
+    """
+    def __init__(self, start_time, hard_limit, empty_squares, total_squares):
+        self.start_time = start_time
+        self.hard_limit = hard_limit
+        filled = 1 - empty_squares / total_squares
+        fraction = next(share for phase_end, share in TIME_TARGETS if filled <= phase_end)
+        self.base_target = (hard_limit - start_time) * fraction
+        self.iteration_seconds = []
+        self.best_moves = []
+
+    def target(self):
+        """
+        Seconds after the start of the turn after which no new iteration is started
+        """
+        target = self.base_target
+        moves = self.best_moves
+        if len(moves) >= 2 and moves[-1] != moves[-2]:
+            target *= TIME_UNSTABLE_FACTOR
+        elif len(moves) >= TIME_STABLE_ITERATIONS and len(set(moves[-TIME_STABLE_ITERATIONS:])) == 1:
+            target *= TIME_STABLE_FACTOR
+        return min(target, self.hard_limit - self.start_time)
+
+    def predict_next_iteration(self):
+        """
+        Predicted seconds of the next iteration: the last one times the effective branching factor, measured over two
+        iterations when possible since odd and even depths alternate in cost. None before two iterations
+        """
+        times = self.iteration_seconds
+        if len(times) < 2:
+            return None
+        if len(times) >= 3:
+            branching_factor = (times[-1] / max(times[-3], 1e-6)) ** 0.5
+        else:
+            branching_factor = times[-1] / max(times[-2], 1e-6)
+        return times[-1] * max(branching_factor, 1.0)
+
+    def should_start_iteration(self, now):
+        if now - self.start_time >= self.target():
+            return False
+        predicted = self.predict_next_iteration()
+        return predicted is None or now + predicted * TIME_PREDICTION_CONFIDENCE <= self.hard_limit
+
+    def record_iteration(self, seconds, best_move):
+        self.iteration_seconds.append(seconds)
+        self.best_moves.append(best_move)
 
 # Define constant matrices for different board sizes
 # Explanation:
@@ -580,19 +1451,1763 @@ POS_WEIGHT_MAP = {
     12: POS_WEIGHTS_12x12
 }
 
+def generate_positional_weights(board_size, corner_mask, x_square_mask, c_square_mask, edge_mask):
+    """
+    Positional weight matrix of a board size without a handcrafted one, with the same values as the matrices above:
+    3 inside, -5 on the second ring, 5 on the edges, 20 two squares from a corner along an edge, 15 two squares from
+    a corner along the diagonal, then the C-squares, X-squares and corners.
+    On 4x4 the second ring and the squares two from a corner fall on the centre and the C-squares, and the X-squares
+    are the starting discs, so only the corners and C-squares are weighted there
+    """
+    n = board_size
+    last = n - 1
+    weights = np.full((n, n), 3)
+    flat_weights = weights.ravel()
+    if n >= 6:
+        weights[[1, last - 1], :] = -5
+        weights[:, [1, last - 1]] = -5
+        flat_weights[squares_of(edge_mask)] = 5
+        for row in (0, last):
+            weights[row, [2, last - 2]] = 20
+            weights[[2, last - 2], row] = 20
+        for row in (2, last - 2):
+            weights[row, [2, last - 2]] = 15
+        flat_weights[squares_of(x_square_mask)] = -40
+    flat_weights[squares_of(c_square_mask)] = -20
+    flat_weights[squares_of(corner_mask)] = 120
+    return weights
+
 def get_positional_weights(board_size):
     """
     Retrieve the positional weight matrix for the given board size
     """
-    if board_size in POS_WEIGHT_MAP:
-        return POS_WEIGHT_MAP[board_size]
-    
+    return get_board_geometry(board_size).positional_weights
+
+# Bitboard game core
+# The board is stored as two python integers, one per player, where square (r, c) is bit r * board_size + c
+# Shifting a bitboard by r_step * board_size + c_step moves every disc one square in direction (r_step, c_step)
+# Each shift is paired with a mask that clears the squares a disc would land on by wrapping around the left/right edge
+# The tables of each board size live in its BoardGeometry, built on first use (see Board geometry below)
+
+try:
+    popcount = int.bit_count  # python 3.10+
+except AttributeError:
+    def popcount(bits):
+        """
+        Count the number of set bits (discs) in a bitboard
+        """
+        return bin(bits).count("1")
+
+def build_shift_masks(board_size, directions):
+    """
+    Build the (shift, mask) pairs used to move a bitboard one step in each of the given directions
+    """
+    full_mask = (1 << (board_size * board_size)) - 1
+    first_column = sum(1 << (r * board_size) for r in range(board_size))
+    last_column = first_column << (board_size - 1)
+
+    shift_masks = []
+    for dx, dy in directions:
+        mask = full_mask
+        if dy == 1:
+            mask &= ~first_column  # moving right must not wrap onto the first column
+        elif dy == -1:
+            mask &= ~last_column  # moving left must not wrap onto the last column
+        shift_masks.append((dx * board_size + dy, mask))
+    return shift_masks
+
+
+def build_positional_masks(positional_weights):
+    """
+    Group the squares of a positional weight matrix into one bitboard per distinct weight
+    """
+    masks = {}
+    for square, weight in enumerate(positional_weights.ravel().tolist()):
+        masks[weight] = masks.get(weight, 0) | (1 << square)
+    return sorted(masks.items())
+
+# Board geometry
+# Everything that only depends on the board size is computed once per size, on the first use of the size, and shared
+# by every agent of the process: masks, shift tables, per-square rays and neighbours, positional weights, Zobrist keys,
+# symmetries... The module level tables (FULL_MASKS[size], SHIFT_MASKS[size], ...) are views of one geometry attribute
+# each, so the hot paths keep a plain dict lookup
+BOARD_SIZES = list(range(4, 17, 2))
+
+class BoardGeometry:
+    """
+    Precomputed tables of one board size
+    rays[square] are the (shift, mask) steps of the directions with room for a flip from the square (at least 2
+    squares before the border), neighbour_masks[square] the mask of its (up to 8) neighbours. The corner, X-square
+    (diagonal to a corner), C-square (next to a corner along an edge) and edge masks are bitboards, edge_masks lists the
+    4 edges (top, bottom, left, right). weight_adjustments are the board size tunings added to the evaluation weights
+    of each phase, in FEATURE_NAMES order
+    """
+    def __init__(self, board_size):
+        n = board_size
+        last = n - 1
+        self.board_size = n
+        self.full_mask = (1 << (n * n)) - 1
+        self.shift_masks = build_shift_masks(n, get_directions())
+
+        def square_mask(squares):
+            return sum(1 << (row * n + col) for row, col in set(squares))
+
+        corners = [(0, 0), (0, last), (last, 0), (last, last)]
+        self.corner_mask = square_mask(corners)
+        self.x_square_mask = square_mask((row + (1 if row == 0 else -1), col + (1 if col == 0 else -1))
+                                         for row, col in corners)
+        self.c_square_mask = square_mask([(row, col + (1 if col == 0 else -1)) for row, col in corners] +
+                                         [(row + (1 if row == 0 else -1), col) for row, col in corners])
+        self.edge_masks = [square_mask((0, col) for col in range(n)), square_mask((last, col) for col in range(n)),
+                           square_mask((row, 0) for row in range(n)), square_mask((row, last) for row in range(n))]
+        self.edge_mask = self.edge_masks[0] | self.edge_masks[1] | self.edge_masks[2] | self.edge_masks[3]
+
+        self.rays = []
+        for square in range(n * n):
+            row, col = divmod(square, n)
+            self.rays.append([(shift, mask) for (shift, mask), (dx, dy) in zip(self.shift_masks, get_directions())
+                              if 0 <= row + 2 * dx < n and 0 <= col + 2 * dy < n])
+        self.neighbour_masks = [bitboard_neighbours(1 << square, n, {n: self.shift_masks}) for square in range(n * n)]
+
+        if n in POS_WEIGHT_MAP:
+            self.positional_weights = POS_WEIGHT_MAP[n]
+        else:
+            self.positional_weights = generate_positional_weights(n, self.corner_mask, self.x_square_mask,
+                                                                  self.c_square_mask, self.edge_mask)
+        self.positional_masks = build_positional_masks(self.positional_weights)
+        self.phase_indices = build_phase_indices(n)
+        self.parity_regions = build_parity_regions(n)
+        self.weight_adjustments = build_weight_adjustments(n)
+
+        self.zobrist_player = build_zobrist_keys(n, 1)
+        self.zobrist_opponent = build_zobrist_keys(n, 2)
+        # Flipping a disc removes one owner's key and adds the other's
+        self.zobrist_flip = [p ^ o for p, o in zip(self.zobrist_player, self.zobrist_opponent)]
+        self.symmetries = build_symmetries(n)
+        self.inverse_symmetries = [sorted(range(n * n), key=permutation.__getitem__) for permutation in self.symmetries]
+
+def build_weight_adjustments(board_size):
+    """
+    Board size tunings of the evaluation weights, {phase index: 8 additions in FEATURE_NAMES order}
+    """
+    adjustments = {}
+    for phase_index in PHASE_NAMES:
+        adjustment = dict.fromkeys(FEATURE_NAMES, 0)
+        if board_size <= 6:
+            if phase_index <= 7:
+                adjustment["mobility"] += 15
+            adjustment["corners"] += 30  # corners and edges are crucial on small boards
+            adjustment["stability"] += 10
+        if board_size >= 10:
+            adjustment["potential_mobility"] += 5  # keeping options matters more on larger boards
+        if board_size >= 12:
+            adjustment["frontier"] -= 5  # penalize frontiers even more on large boards
+        adjustments[phase_index] = [adjustment[name] for name in FEATURE_NAMES]
+    return adjustments
+
+BOARD_GEOMETRIES = {}
+
+def get_board_geometry(board_size):
+    """
+    Geometry of a board size, built on first use
+    """
+    geometry = BOARD_GEOMETRIES.get(board_size)
+    if geometry is None:
+        if board_size not in BOARD_SIZES:
+            raise ValueError(f"unsupported board size {board_size}, expected an even size from 4 to 16")
+        geometry = BOARD_GEOMETRIES[board_size] = BoardGeometry(board_size)
+    return geometry
+
+class GeometryTable(dict):
+    """
+    One attribute of the board geometries by board size, a size missing from the dict is filled from its geometry
+    """
+    def __init__(self, attribute):
+        super().__init__()
+        self.attribute = attribute
+
+    def __missing__(self, board_size):
+        value = self[board_size] = getattr(get_board_geometry(board_size), self.attribute)
+        return value
+
+FULL_MASKS = GeometryTable("full_mask")
+CORNER_MASKS = GeometryTable("corner_mask")
+SHIFT_MASKS = GeometryTable("shift_masks")
+FLIP_RAYS = GeometryTable("rays")
+NEIGHBOUR_MASKS = GeometryTable("neighbour_masks")
+POSITIONAL_MASKS = GeometryTable("positional_masks")
+PHASE_INDICES = GeometryTable("phase_indices")
+PARITY_REGION_MASKS = GeometryTable("parity_regions")
+ZOBRIST_PLAYER = GeometryTable("zobrist_player")
+ZOBRIST_OPPONENT = GeometryTable("zobrist_opponent")
+ZOBRIST_FLIP = GeometryTable("zobrist_flip")
+SYMMETRIES = GeometryTable("symmetries")
+INVERSE_SYMMETRIES = GeometryTable("inverse_symmetries")
+
+def board_to_bitboards(chess_board, player, opponent):
+    """
+    Convert a numpy board into the (player_bits, opponent_bits) pair
+    """
+    flat_board = chess_board.ravel()
+    player_bits = int.from_bytes(np.packbits(flat_board == player, bitorder='little').tobytes(), 'little')
+    opponent_bits = int.from_bytes(np.packbits(flat_board == opponent, bitorder='little').tobytes(), 'little')
+    return player_bits, opponent_bits
+
+def squares_of(bits):
+    """
+    List the square indices set in a bitboard, in increasing order
+    """
+    squares = []
+    while bits:
+        lowest = bits & -bits
+        squares.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return squares
+
+def bitboard_neighbours(bits, board_size, shift_mask_table=SHIFT_MASKS):
+    """
+    Get the mask of squares adjacent to at least one square of bits
+    """
+    neighbours = 0
+    for shift, mask in shift_mask_table[board_size]:
+        if shift > 0:
+            neighbours |= (bits << shift) & mask
+        else:
+            neighbours |= (bits >> -shift) & mask
+    return neighbours
+
+def build_phase_indices(board_size):
+    """
+    Map a disc count to the index of its game phase weights: early (0), middle (7) or end (14) game
+    """
+    total_squares = board_size * board_size
+    phase_indices = []
+    for total_discs in range(total_squares + 1):
+        if total_discs <= total_squares * 0.25:
+            phase_indices.append(0)
+        elif total_discs <= total_squares * 0.75:
+            phase_indices.append(7)
+        else:
+            phase_indices.append(14)
+    return phase_indices
+
+def bitboard_valid_moves(mover_bits, other_bits, board_size):
+    """
+    Get the mask of legal moves for the side owning mover_bits
+    """
+    empty = FULL_MASKS[board_size] & ~(mover_bits | other_bits)
+    moves = 0
+    for shift, mask in SHIFT_MASKS[board_size]:
+        # Walk every run of opponent discs that starts next to one of the mover's discs
+        if shift > 0:
+            run = (mover_bits << shift) & mask & other_bits
+            line = run
+            while run:
+                run = (run << shift) & mask & other_bits
+                line |= run
+            moves |= (line << shift) & mask & empty
+        else:
+            shift = -shift
+            run = (mover_bits >> shift) & mask & other_bits
+            line = run
+            while run:
+                run = (run >> shift) & mask & other_bits
+                line |= run
+            moves |= (line >> shift) & mask & empty
+    return moves
+
+def bitboard_flips(mover_bits, other_bits, square, board_size):
+    """
+    Get the mask of opponent discs flipped when the mover plays on square
+    """
+    move_bit = 1 << square
+    flips = 0
+    for shift, mask in FLIP_RAYS[board_size][square]:
+        line = 0
+        if shift > 0:
+            cursor = (move_bit << shift) & mask
+            while cursor & other_bits:
+                line |= cursor
+                cursor = (cursor << shift) & mask
+        else:
+            shift = -shift
+            cursor = (move_bit >> shift) & mask
+            while cursor & other_bits:
+                line |= cursor
+                cursor = (cursor >> shift) & mask
+        if cursor & mover_bits:
+            flips |= line
+    return flips
+
+def initial_position(board_size):
+    """
+    Starting position as (mover_bits, other_bits), player 1 moves first
+    """
+    mid = board_size // 2
+    mover_bits = (1 << ((mid - 1) * board_size + mid)) | (1 << (mid * board_size + mid - 1))
+    other_bits = (1 << ((mid - 1) * board_size + mid - 1)) | (1 << (mid * board_size + mid))
+    return mover_bits, other_bits
+
+def play(mover_bits, other_bits, move, board_size):
+    """
+    Play a move and return the new position from the next mover's point of view
+    """
+    flips = bitboard_flips(mover_bits, other_bits, move, board_size)
+    return other_bits & ~flips, mover_bits | (1 << move) | flips
+
+# Exact endgame solver
+# Number of empty squares at which the solver takes over from the heuristic search, for each board size
+ENDGAME_EMPTIES = {4: 12, 6: 12, 8: 11, 10: 11, 12: 11, 14: 10, 16: 10}
+
+def build_parity_regions(board_size):
+    """
+    Map every square to the mask of its quadrant, the regions used for parity move ordering in the endgame
+    """
+    half = board_size // 2
+    quadrants = {}
+    for square in range(board_size * board_size):
+        row, col = divmod(square, board_size)
+        quadrant = (row >= half, col >= half)
+        quadrants[quadrant] = quadrants.get(quadrant, 0) | (1 << square)
+    return [quadrants[(row >= half, col >= half)] for row, col in
+            (divmod(square, board_size) for square in range(board_size * board_size))]
+
+def final_disc_difference(mover_bits, other_bits, empty_bits):
+    """
+    Final score of a finished game from the mover's point of view, the empty squares go to the winner
+    """
+    difference = popcount(mover_bits) - popcount(other_bits)
+    if difference > 0:
+        return difference + popcount(empty_bits)
+    if difference < 0:
+        return difference - popcount(empty_bits)
+    return 0
+
+# Zobrist hashing
+# Every (square, owner) pair gets a fixed random 63-bit key and a position's hash is the XOR of the keys of its discs,
+# so a move only has to XOR in the new disc, the flipped discs and the side to move
+ZOBRIST_SIDE = random.Random(424).getrandbits(63)
+
+def build_zobrist_keys(board_size, seed):
+    """
+    Generate one random 63-bit key per square (63 bits so it fits in the table's int64 array)
+    """
+    rng = random.Random(seed * 100 + board_size)
+    return [rng.getrandbits(63) for _ in range(board_size * board_size)]
+
+# Disc stability
+# A stable disc can never be flipped again. Edge discs can only be flipped along their edge, which is solved exactly
+# once per board size for every configuration of an edge. An interior disc is stable when, on each of the 4 lines
+# through it, the line is full, or the disc touches the border or a stable disc of its colour: the stable set is grown
+# from the stable edge discs with bitwise shifts until it stops changing
+# Exact edge tables have 3 ** board_size entries, larger boards use the discs of full edges and the runs of a side's
+# discs from a corner instead (corner_run_stable), a subset of the exact stable edge discs
+STABILITY_AXES = [((0, 1), (0, -1)), ((1, 0), (-1, 0)), ((1, 1), (-1, -1)), ((1, -1), (-1, 1))]
+EXACT_EDGE_STABILITY_SIZE = 12
+
+def build_edge_stability(line_size):
+    """
+    Stable discs of a line of line_size squares (an edge) for each of its 3 ** line_size configurations, indexed by
+    the sum of 3 ** i over own discs plus 2 * 3 ** i over the other side's, as a bitmask of the own stable discs.
+    A disc is stable if no sequence of discs placed on the empty squares, by either side and legal on the line or not
+    (the move can flip along another line), ever flips it. Solved from the full lines down to the empty one, a
+    configuration's stable discs being its own discs that are stable in every configuration one disc later
+    """
+    powers = 3 ** np.arange(line_size)
+    digits = (np.arange(3 ** line_size)[:, np.newaxis] // powers % 3).astype(np.int8)
+    stable = ((digits == 1) * (1 << np.arange(line_size))).sum(axis=1).astype(np.uint16)
+    empties = (digits == 0).sum(axis=1)
+    for level in range(1, line_size + 1):
+        states = np.nonzero(empties == level)[0]
+        columns = digits[states].T.copy()  # the digits of each square contiguous
+        level_stable = stable[states]
+        for square in range(line_size):
+            playable = np.nonzero(columns[square] == 0)[0]
+            line = columns[:, playable]
+            for colour in (1, 2):
+                # Index of the configuration after the move: the new disc, then the runs of the other colour closed
+                # by a disc of this colour on each side change colour
+                child = states[playable] + colour * powers[square]
+                for step in (-1, 1):
+                    in_run = np.ones(len(playable), dtype=bool)
+                    closed = np.zeros(len(playable), dtype=bool)
+                    run = []
+                    position = square + step
+                    while 0 <= position < line_size:
+                        closed |= in_run & (line[position] == colour)
+                        in_run = in_run & (line[position] == 3 - colour)
+                        if not in_run.any():
+                            break
+                        run.append((position, in_run))
+                        position += step
+                    for position, flipped in run:
+                        child += (flipped & closed) * ((2 * colour - 3) * powers[position])
+                level_stable[playable] &= stable[child]
+        stable[states] = level_stable
+    return array.array("H", stable.tobytes())
+
+# Exact edge tables of every board size that has one, solved once at import (about half a second for all of them,
+# 12x12 being most of it) so no turn, not even the first one of a size, pays for them
+EDGE_STABILITY_TABLES = {n: build_edge_stability(n) for n in BOARD_SIZES if n <= EXACT_EDGE_STABILITY_SIZE}
+
+def corner_run_stable(own_line, other_line, line_mask):
+    """
+    Own stable discs of an edge without an exact table: all of them on a full edge, else the runs from its two ends
+    """
+    if own_line | other_line == line_mask:
+        return own_line
+    low_run = own_line & ~(own_line + 1)
+    high_run = line_mask & ~((1 << (own_line ^ line_mask).bit_length()) - 1)
+    return low_run | high_run
+
+class StabilityTables:
+    """
+    Precomputed data of the stability analysis for one board size: the edge table, the maps between an edge and its
+    bits on the board, and for each axis the masks of its lines and of the squares whose line ends at them
+    """
+    def __init__(self, board_size):
+        n = board_size
+        self.board_size = n
+        self.corner_mask = CORNER_MASKS[n]
+        self.line_mask = (1 << n) - 1
+        self.bottom_shift = n * (n - 1)
+        self.first_column = sum(1 << (row * n) for row in range(n))
+        # Multiplying the first column by this moves square (k, 0) to bit n * n + k without any carries
+        self.column_magic = sum(1 << (n * n + row - row * n) for row in range(n))
+        self.edge = None
+        if n <= EXACT_EDGE_STABILITY_SIZE:
+            self.edge = EDGE_STABILITY_TABLES[n]
+            self.base3 = [sum(3 ** i for i in range(n) if line >> i & 1) for line in range(1 << n)]
+        else:
+            self.edge_stable = self.corner_edge_stable
+        self.column_spread = [sum(1 << (i * n) for i in range(n) if line >> i & 1) for line in range(1 << n)]
+
+        full_mask = FULL_MASKS[n]
+        self.axis_shift_masks = []
+        self.axis_lines = []
+        self.axis_walls = []
+        for forward, backward in STABILITY_AXES:
+            shift_masks = build_shift_masks(n, [forward, backward])
+            self.axis_shift_masks.append(shift_masks)
+            inside = full_mask
+            for shift, mask in shift_masks:
+                inside &= (full_mask << shift if shift > 0 else full_mask >> -shift) & mask
+            self.axis_walls.append(full_mask & ~inside)
+            # Lines of the axis of 2 squares or more, found from the squares whose line starts there
+            lines = []
+            for start in squares_of(full_mask & ~((full_mask << shift_masks[0][0]) & shift_masks[0][1])):
+                line = 0
+                row, col = divmod(start, n)
+                while 0 <= row < n and 0 <= col < n:
+                    line |= 1 << (row * n + col)
+                    row, col = row + forward[0], col + forward[1]
+                if popcount(line) >= 2:
+                    lines.append(line)
+            self.axis_lines.append(lines)
+
+    def edge_stable(self, player_bits, opponent_bits):
+        """
+        Masks of the discs of each side that are stable along the 4 edges, (player's, opponent's)
+        """
+        n = self.board_size
+        line_mask = self.line_mask
+        edge = self.edge
+        base3 = self.base3
+        player_code, opponent_code = base3[player_bits & line_mask], base3[opponent_bits & line_mask]
+        player_stable = edge[player_code + 2 * opponent_code]
+        opponent_stable = edge[opponent_code + 2 * player_code]
+        shift = self.bottom_shift
+        player_code, opponent_code = base3[player_bits >> shift & line_mask], base3[opponent_bits >> shift & line_mask]
+        player_stable |= edge[player_code + 2 * opponent_code] << shift
+        opponent_stable |= edge[opponent_code + 2 * player_code] << shift
+        first_column, magic, spread = self.first_column, self.column_magic, self.column_spread
+        for column in (0, n - 1):
+            player_code = base3[((player_bits >> column & first_column) * magic) >> (n * n) & line_mask]
+            opponent_code = base3[((opponent_bits >> column & first_column) * magic) >> (n * n) & line_mask]
+            player_stable |= spread[edge[player_code + 2 * opponent_code]] << column
+            opponent_stable |= spread[edge[opponent_code + 2 * player_code]] << column
+        return player_stable, opponent_stable
+
+    def corner_edge_stable(self, player_bits, opponent_bits):
+        """
+        edge_stable of the boards without an exact edge table, with corner_run_stable on each edge
+        """
+        n = self.board_size
+        line_mask = self.line_mask
+        shift = self.bottom_shift
+        player_stable, opponent_stable = 0, 0
+        for line_shift in (0, shift):
+            player_line, opponent_line = player_bits >> line_shift & line_mask, opponent_bits >> line_shift & line_mask
+            player_stable |= corner_run_stable(player_line, opponent_line, line_mask) << line_shift
+            opponent_stable |= corner_run_stable(opponent_line, player_line, line_mask) << line_shift
+        first_column, magic, spread = self.first_column, self.column_magic, self.column_spread
+        for column in (0, n - 1):
+            player_line = ((player_bits >> column & first_column) * magic) >> (n * n) & line_mask
+            opponent_line = ((opponent_bits >> column & first_column) * magic) >> (n * n) & line_mask
+            player_stable |= spread[corner_run_stable(player_line, opponent_line, line_mask)] << column
+            opponent_stable |= spread[corner_run_stable(opponent_line, player_line, line_mask)] << column
+        return player_stable, opponent_stable
+
+# Tables built so far, only for the sizes actually played
+STABILITY_TABLES = {}
+
+def get_stability_tables(board_size):
+    tables = STABILITY_TABLES.get(board_size)
+    if tables is None:
+        tables = STABILITY_TABLES[board_size] = StabilityTables(board_size)
+    return tables
+
+def bitboard_stability(player_bits, opponent_bits, board_size):
+    """
+    Get the masks of the stable discs of both sides, (player's, opponent's)
+    """
+    tables = get_stability_tables(board_size)
+    occupied = player_bits | opponent_bits
+    player_stable, opponent_stable = tables.edge_stable(player_bits, opponent_bits)
+    if not player_stable | opponent_stable:
+        # Any other stable disc needs a full row (an interior disc with all 4 lines full) to start from
+        for row in tables.axis_lines[0]:
+            if occupied & row == row:
+                break
+        else:
+            return 0, 0
+
+    # Per axis, the squares that cannot be flipped along it whatever their neighbours: full lines and border squares
+    settled = []
+    for lines, wall in zip(tables.axis_lines, tables.axis_walls):
+        for line in lines:
+            if occupied & line == line:
+                wall |= line
+        settled.append(wall)
+    all_settled = settled[0] & settled[1] & settled[2] & settled[3]
+
+    stable_masks = []
+    for own_bits, stable in ((player_bits, player_stable), (opponent_bits, opponent_stable)):
+        stable |= own_bits & all_settled
+        candidates = own_bits & ~stable
+        while stable and candidates:
+            grown = candidates
+            for shift_masks, axis_settled in zip(tables.axis_shift_masks, settled):
+                (forward, forward_mask), (backward, backward_mask) = shift_masks
+                grown &= axis_settled | ((stable << forward) & forward_mask) | ((stable >> -backward) & backward_mask)
+            if not grown:
+                break
+            stable |= grown
+            candidates ^= grown
+        stable_masks.append(stable)
+    return stable_masks[0], stable_masks[1]
+
+# Opening book
+# One binary file per board size: a 16 byte header (magic, board size, entry count) followed by fixed-size records
+# sorted by key, so the file can be memory-mapped and binary searched without loading it.
+# Positions are keyed from the side to move's point of view with the 8 board symmetries folded together
+OPENING_BOOK_MAGIC = b"RVBOOK01"
+OPENING_BOOK_HEADER_SIZE = 16
+OPENING_BOOK_DTYPE = np.dtype([("key", "<i8"), ("move", "<i2"), ("depth", "<i2"), ("score", "<f4")])
+OPENING_BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_books")
+
+def opening_book_path(board_size, directory=OPENING_BOOK_DIR):
+    """
+    Path of the opening book file for a board size
+    """
+    return os.path.join(directory, f"book_{board_size}x{board_size}.bin")
+
+def build_symmetries(board_size):
+    """
+    Build the 8 symmetries of the board (rotations and reflections) as square permutations
+    """
+    last = board_size - 1
+    transforms = [
+        lambda r, c: (r, c), lambda r, c: (c, last - r), lambda r, c: (last - r, last - c), lambda r, c: (last - c, r),
+        lambda r, c: (r, last - c), lambda r, c: (last - r, c), lambda r, c: (c, r), lambda r, c: (last - c, last - r),
+    ]
+    symmetries = []
+    for transform in transforms:
+        permutation = []
+        for square in range(board_size * board_size):
+            row, col = transform(*divmod(square, board_size))
+            permutation.append(row * board_size + col)
+        symmetries.append(permutation)
+    return symmetries
+
+def transform_bits(bits, permutation):
+    """
+    Apply a square permutation to a bitboard
+    """
+    transformed = 0
+    for square in squares_of(bits):
+        transformed |= 1 << permutation[square]
+    return transformed
+
+def canonical_position(mover_bits, other_bits, board_size):
+    """
+    Fold the 8 symmetric versions of a position into one: returns (key, symmetry), the Zobrist key of the smallest
+    transformed position and the index of the symmetry that produces it
+    """
+    best_position, best_symmetry = None, 0
+    for symmetry, permutation in enumerate(SYMMETRIES[board_size]):
+        position = (transform_bits(mover_bits, permutation), transform_bits(other_bits, permutation))
+        if best_position is None or position < best_position:
+            best_position, best_symmetry = position, symmetry
+    key = 0
+    for square in squares_of(best_position[0]):
+        key ^= ZOBRIST_PLAYER[board_size][square]
+    for square in squares_of(best_position[1]):
+        key ^= ZOBRIST_OPPONENT[board_size][square]
+    return key, best_symmetry
+
+class OpeningBook:
+    """
+    Read-only memory-mapped opening book for one board size
+    """
+    def __init__(self, path):
+        with open(path, "rb") as book_file:
+            header = book_file.read(OPENING_BOOK_HEADER_SIZE)
+        if len(header) != OPENING_BOOK_HEADER_SIZE or header[:8] != OPENING_BOOK_MAGIC:
+            raise ValueError(f"{path} is not an opening book")
+        self.board_size, count = (int(value) for value in np.frombuffer(header[8:], dtype="<i4"))
+        if count:
+            self.records = np.memmap(path, dtype=OPENING_BOOK_DTYPE, mode="r", offset=OPENING_BOOK_HEADER_SIZE,
+                                     shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=OPENING_BOOK_DTYPE)
+        self.keys = self.records["key"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        """
+        Return the (canonical move, score, depth) stored under a canonical key, or None
+        """
+        index = int(np.searchsorted(self.keys, key))
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        record = self.records[index]
+        return int(record["move"]), float(record["score"]), int(record["depth"])
+
+    def lookup(self, mover_bits, other_bits):
+        """
+        Return (move, score, depth) for the position with mover_bits to move, or None if it is not in the book
+        """
+        key, symmetry = canonical_position(mover_bits, other_bits, self.board_size)
+        entry = self.get(key)
+        if entry is None:
+            return None
+        move, score, depth = entry
+        return INVERSE_SYMMETRIES[self.board_size][symmetry][move], score, depth
+
+    @staticmethod
+    def write(path, board_size, entries):
+        """
+        Write a book file from a {key: (canonical move, score, depth)} dict, replacing the old file atomically
+        """
+        records = np.zeros(len(entries), dtype=OPENING_BOOK_DTYPE)
+        for index, key in enumerate(sorted(entries)):
+            move, score, depth = entries[key]
+            records[index] = (key, move, depth, score)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as book_file:
+            book_file.write(OPENING_BOOK_MAGIC)
+            book_file.write(np.array([board_size, len(records)], dtype="<i4").tobytes())
+            book_file.write(records.tobytes())
+        os.replace(temporary_path, path)
+
+# Books opened so far (None when a board size has no book file)
+OPENING_BOOKS = {}
+
+def get_opening_book(board_size):
+    """
+    Open the book for a board size on first use
+    """
+    if board_size not in OPENING_BOOKS:
+        path = opening_book_path(board_size)
+        OPENING_BOOKS[board_size] = OpeningBook(path) if os.path.exists(path) else None
+    return OPENING_BOOKS[board_size]
+
+# Tuned evaluation weights
+# JSON file written by tune_weights.py: for each board size, the weights of the 8 heuristics in each phase
+FEATURE_NAMES = ["pieces", "corners", "mobility", "stability", "frontier", "parity", "position", "potential_mobility"]
+PHASE_NAMES = {0: "early", 7: "mid", 14: "late"}
+
+def load_tuned_weights(path):
+    """
+    Read a tuned weights file as {board_size: {phase_index: 8 weights}}
+    """
+    with open(path) as weights_file:
+        data = json.load(weights_file)
+    if data.get("feature_names") != FEATURE_NAMES:
+        raise ValueError(f"{path}: weights for features {data.get('feature_names')}, expected {FEATURE_NAMES}")
+    tuned_weights = {}
+    for board_size, phases in data["board_sizes"].items():
+        tuned_weights[int(board_size)] = {
+            phase_index: tuple(float(weight) for weight in phases[name]) for phase_index, name in PHASE_NAMES.items()
+        }
+        if any(len(weights) != len(FEATURE_NAMES) for weights in tuned_weights[int(board_size)].values()):
+            raise ValueError(f"{path}: {board_size}x{board_size} weights need {len(FEATURE_NAMES)} values per phase")
+    return tuned_weights
+
+# Pattern evaluation
+# An optional evaluator made of lookup tables. A pattern is a fixed list of squares whose contents (0 empty, 1 ours,
+# 2 theirs) read as a base 3 number index a table of values, with one table per game phase. The symmetric copies of a
+# pattern share its table. Tables are fitted offline with train_patterns.py, one .npz file per board size
+PATTERN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patterns")
+PATTERN_PHASES = 6
+
+def pattern_path(board_size, directory=PATTERN_DIR):
+    """
+    Path of the pattern tables file of a board size
+    """
+    return os.path.join(directory, f"patterns_{board_size}x{board_size}.npz")
+
+def build_pattern_shapes(board_size):
+    """
+    The pattern types of a board size as {name: squares} in one orientation, the first square being the lowest base 3
+    digit: the edge with its X-squares (the 8 edge squares from a corner and one X-square on boards larger than 8),
+    the 3x3 corner, the 2x5 corner block, and the diagonals from 4 squares up to the main one (cut at 8 squares)
+    """
+    n = board_size
+    longest = min(n, 8)
+    edge = [col for col in range(longest)] + [n + 1]
+    if longest == n:
+        edge.append(2 * n - 2)
+    shapes = {
+        "edge_x": edge,
+        "corner_3x3": [row * n + col for row in range(3) for col in range(3)],
+        "block_2x5": [row * n + col for row in range(2) for col in range(min(n, 5))],
+    }
+    for length in range(4, longest):
+        shapes[f"diagonal_{length}"] = [i * n + length - 1 - i for i in range(length)]
+    shapes[f"diagonal_{longest}"] = [i * n + i for i in range(longest)]
+    return shapes
+
+class PatternSet:
+    """
+    Pattern instances and value tables of one board size
+    Each instance is a slot of the index list kept by an EvaluationState and square_refs[square] lists the
+    (slot, power of 3) pairs of the instances containing the square. The tables of all the pattern types are
+    concatenated into one float32 array per phase and an instance's index includes the offset of its type, so a
+    position's value is one take and sum. tempo is a per phase bonus for the side to move
+    """
+    def __init__(self, board_size, path=None):
+        self.board_size = board_size
+        shapes = build_pattern_shapes(board_size)
+        self.names = list(shapes)
+        self.sizes = [3 ** len(shapes[name]) for name in self.names]
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)[:-1]]).tolist()
+
+        # All the distinct symmetric copies of each shape
+        self.instances = []  # (type number, squares)
+        for type_number, name in enumerate(self.names):
+            seen = set()
+            for permutation in SYMMETRIES[board_size]:
+                squares = [permutation[square] for square in shapes[name]]
+                if frozenset(squares) not in seen:
+                    seen.add(frozenset(squares))
+                    self.instances.append((type_number, squares))
+        self.instance_offsets = [self.offsets[type_number] for type_number, squares in self.instances]
+        self.square_refs = [[] for square in range(board_size * board_size)]
+        for slot, (type_number, squares) in enumerate(self.instances):
+            for digit, square in enumerate(squares):
+                self.square_refs[square].append((slot, 3 ** digit))
+
+        # Phases split the game in equal disc count intervals
+        total_squares = board_size * board_size
+        self.phase_of = [min(PATTERN_PHASES - 1, max(discs - 4, 0) * PATTERN_PHASES // (total_squares - 3))
+                         for discs in range(total_squares + 1)]
+
+        path = path or pattern_path(board_size)
+        if os.path.exists(path):
+            self.tables, self.tempo = self.load(path)
+        else:
+            self.tables, self.tempo = self.positional_tables(), np.zeros(PATTERN_PHASES, dtype=np.float32)
+
+    def load(self, path):
+        """
+        Read (tables, tempo) from a file written by write, which must match this board size's pattern types
+        """
+        with np.load(path) as data:
+            if int(data["board_size"]) != self.board_size or data["names"].tolist() != self.names:
+                raise ValueError(f"{path} does not hold the {self.board_size}x{self.board_size} patterns")
+            return data["tables"].astype(np.float32), data["tempo"].astype(np.float32)
+
+    def write(self, path, tables, tempo):
+        """
+        Save fitted tables (PATTERN_PHASES, total size) and tempo bonuses (PATTERN_PHASES,)
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(path, board_size=self.board_size, names=np.array(self.names),
+                            tables=np.asarray(tables, dtype=np.float32), tempo=np.asarray(tempo, dtype=np.float32))
+
+    def positional_tables(self):
+        """
+        Tables used until fitted ones exist: each configuration is worth the positional weights of its discs, divided
+        by how many instances cover each square, so the sum over a board is the positional score of the covered squares
+        """
+        weights = get_positional_weights(self.board_size).ravel()
+        coverage = np.array([len(refs) for refs in self.square_refs])
+        shapes = build_pattern_shapes(self.board_size)
+        tables = []
+        for name, size in zip(self.names, self.sizes):
+            squares = shapes[name]
+            digits = np.arange(size)[:, np.newaxis] // 3 ** np.arange(len(squares)) % 3
+            signs = np.where(digits == 1, 1.0, np.where(digits == 2, -1.0, 0.0))
+            tables.append(signs @ (weights[squares] / coverage[squares]))
+        return np.tile(np.concatenate(tables).astype(np.float32), (PATTERN_PHASES, 1))
+
+    def indices(self, player_bits, opponent_bits):
+        """
+        Table indices (offsets included) of all the instances for a position
+        """
+        indices = list(self.instance_offsets)
+        for bits, digit in ((player_bits, 1), (opponent_bits, 2)):
+            for square in squares_of(bits):
+                for slot, power in self.square_refs[square]:
+                    indices[slot] += digit * power
+        return indices
+
+# Pattern sets loaded so far
+PATTERN_SETS = {}
+
+def get_pattern_set(board_size):
+    """
+    Load the pattern tables of a board size on first use
+    """
+    if board_size not in PATTERN_SETS:
+        PATTERN_SETS[board_size] = PatternSet(board_size)
+    return PATTERN_SETS[board_size]
+
+# Bounded caches
+# Memory of one entry (key, value and slot bookkeeping) on 12x12, where the move masks and move lists are the largest,
+# used to turn a byte budget into a capacity so the budget holds on every board size
+EVALUATION_CACHE_ENTRY_BYTES = 330
+ORDERING_CACHE_ENTRY_BYTES = 1600
+
+class BoundedCache:
+    """
+    Fixed-capacity map from a position hash to a value with CLOCK eviction (an approximation of LRU): every hit sets
+    the entry's reference bit, and when the cache is full the clock hand sweeps the slots, clearing reference bits,
+    until it finds an entry not used since its last pass, which is replaced. Hits and misses are counted
+    """
+    def __init__(self, byte_budget, entry_bytes):
+        self.capacity = max(1, byte_budget // entry_bytes)
+        self.slots = {}  # key -> slot
+        self.keys = [None] * self.capacity
+        self.values = [None] * self.capacity
+        self.referenced = bytearray(self.capacity)
+        self.hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Value stored for the key, or None
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.referenced[slot] = 1
+        return self.values[slot]
+
+    def put(self, key, value):
+        """
+        Store the value for the key, evicting the first entry the clock hand finds unreferenced if the cache is full
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            if len(self.slots) < self.capacity:
+                slot = len(self.slots)
+            else:
+                referenced = self.referenced
+                hand = self.hand
+                while referenced[hand]:
+                    referenced[hand] = 0
+                    hand = hand + 1 if hand + 1 < self.capacity else 0
+                slot = hand
+                self.hand = hand + 1 if hand + 1 < self.capacity else 0
+                del self.slots[self.keys[slot]]
+                self.evictions += 1
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.values[slot] = value
+        self.referenced[slot] = 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def to_record(self):
+        """
+        JSON-serializable usage statistics
+        """
+        return {"entries": len(self.slots), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate(), "evictions": self.evictions}
+
+# Transposition table bound flags
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Scores are stored in fixed point so an entry fits in one int64 word
+TT_SCORE_SCALE = 1024
+
+# Principal variation search: width of the null window (the transposition table's score resolution) and initial half
+# width of the root's aspiration window in evaluation points, doubled on every fail high or fail low
+NULL_WINDOW = 1 / TT_SCORE_SCALE
+ASPIRATION_WINDOW = 200
+
+# History scores are divided by 2 ** HISTORY_AGING_SHIFT at the start of every turn, so the moves that were good in
+# the previous searches still come first but recent searches weigh more
+HISTORY_AGING_SHIFT = 1
+
+# Multi-ProbCut: for each board size and search depth, the shallow searches (shallow_depth, slope, intercept, sigma)
+# whose score predicts the depth's score as slope * score + intercept with an error of standard deviation sigma,
+# tried from the cheapest. A node is cut when the prediction falls more than MPC_THRESHOLD sigmas outside the window.
+# Fitted from the side to move's point of view on 200 positions of seeded random games (disc count uniform between 6
+# and the endgame solver's threshold) with
+#     python -m agents.calibrate_probcut --board_size 6 --positions 200 --max_depth 8 --shallow_gap 4 --seed 0
+#     python -m agents.calibrate_probcut --board_size 8 --positions 200 --max_depth 8 --shallow_gap 4 --seed 0
+#     python -m agents.calibrate_probcut --board_size 10 --positions 200 --max_depth 6 --shallow_gap 4 --seed 0
+#     python -m agents.calibrate_probcut --board_size 12 --positions 200 --max_depth 6 --shallow_gap 4 --seed 0
+MPC_THRESHOLD = 1.5
+MPC_PARAMETERS = {
+    6: {
+        3: ((1, 1.048, -217.4, 510.5),),
+        4: ((2, 1.101, 40.2, 615.4),),
+        5: ((1, 1.05, -305.6, 752.5), (3, 1.007, -90.7, 527.5),),
+        6: ((2, 1.065, 116.0, 753.3), (4, 0.947, 76.9, 584.6),),
+        7: ((3, 1.027, -72.2, 657.7), (5, 1.001, 31.6, 520.0),),
+        8: ((4, 1.016, 163.2, 662.5), (6, 1.051, 82.2, 447.1),),
+    },
+    8: {
+        3: ((1, 0.956, 3.2, 298.1),),
+        4: ((2, 1.047, 25.5, 285.3),),
+        5: ((1, 1.025, -38.3, 420.5), (3, 1.074, -42.7, 264.1),),
+        6: ((2, 1.117, 48.0, 398.0), (4, 1.068, 20.6, 244.4),),
+        7: ((3, 1.156, -123.1, 397.4), (5, 1.083, -80.5, 238.9),),
+        8: ((4, 1.118, 33.2, 399.4), (6, 1.053, 10.7, 267.2),),
+    },
+    10: {
+        3: ((1, 1.032, -104.5, 267.9),),
+        4: ((2, 1.046, -27.8, 235.9),),
+        5: ((1, 1.045, -163.5, 377.8), (3, 1.023, -63.7, 205.1),),
+        6: ((2, 1.047, -54.9, 363.1), (4, 1.009, -28.2, 232.2),),
+    },
+    12: {
+        3: ((1, 0.994, -31.5, 207.3),),
+        4: ((2, 1.022, -30.7, 218.7),),
+        5: ((1, 1.007, -85.1, 338.7), (3, 1.029, -65.3, 208.3),),
+        6: ((2, 1.049, -44.8, 302.2), (4, 1.039, -16.8, 133.2),),
+    },
+}
+
+# Number of int64 control words at the start of a shared table
+TT_CONTROL_WORDS = 8
+
+# Shared tables created by this process, forked workers find them here instead of attaching again
+SHARED_TABLES = {}
+
+class TranspositionTable:
+    """
+    Fixed-size transposition table stored in preallocated numpy arrays
+    Each entry is two int64 words, the packed data (score, depth, flag, best move, generation) and the key XOR the data,
+    so a probe rejects an entry torn by a concurrent write from another process without any locking.
+    Each bucket has two slots: a depth-preferred slot and an always-replace slot.
+    Entries from previous searches (turns) are kept and reused, but they can be replaced by any new entry.
+    With shared=True the words live in shared memory so parallel search workers use the same table
+    """
+    def __init__(self, size, board_size, shared=False, shared_name=None):
+        self.size = size
+        self.board_size = board_size
+        self.bucket_count = 1 << max(size // 2, 1).bit_length() - 1  # power of two so a mask can pick the bucket
+        self.bucket_mask = self.bucket_count - 1
+        entries = 2 * self.bucket_count
+        self.generation = 0
+        self.shared_memory = None
+
+        # The block starts with a few control words shared by the processes (control[0]: token of the current
+        # background search, see StudentAgent.search_token)
+        if shared_name is not None:
+            # Worker that was not forked from the owner (spawn start method): attach to the existing block
+            self.shared_memory = shared_memory.SharedMemory(name=shared_name)
+        elif shared:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=(2 * entries + TT_CONTROL_WORDS) * 8)
+            SHARED_TABLES[self.shared_memory.name] = self
+            self.finalizer = weakref.finalize(self, release_shared_memory, self.shared_memory)
+        if self.shared_memory is not None:
+            self.control = np.ndarray(TT_CONTROL_WORDS, dtype=np.int64, buffer=self.shared_memory.buf)
+            words = np.ndarray((2, entries), dtype=np.int64, buffer=self.shared_memory.buf, offset=TT_CONTROL_WORDS * 8)
+            if shared_name is None:
+                self.control[:] = 0
+                words[:] = 0
+        else:
+            self.control = np.zeros(TT_CONTROL_WORDS, dtype=np.int64)
+            words = np.zeros((2, entries), dtype=np.int64)
+        self.checks = words[0]
+        self.data = words[1]
+
+    def close(self):
+        """
+        Release the shared memory block (no-op for a private table)
+        """
+        if self.shared_memory is not None and self.shared_memory.name in SHARED_TABLES:
+            del SHARED_TABLES[self.shared_memory.name]
+            self.checks = self.data = self.control = None
+            self.finalizer()
+
+    def new_search(self):
+        """
+        Start a new search, entries stored before this become replaceable
+        """
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, board_hash):
+        """
+        Return (score, depth, flag, best_move) for the position, or None if it is not in the table
+        """
+        slot = (board_hash & self.bucket_mask) << 1
+        data = int(self.data[slot])
+        if int(self.checks[slot]) ^ data != board_hash or not data:
+            slot += 1
+            data = int(self.data[slot])
+            if int(self.checks[slot]) ^ data != board_hash or not data:
+                return None
+        # data layout, low to high: generation (8 bits), best move + 1 (9), flag (2), depth + 1 (7), score (rest)
+        move = (data >> 8 & 0x1FF) - 1
+        return ((data >> 26) / TT_SCORE_SCALE, (data >> 19 & 0x7F) - 1, data >> 17 & 0x3,
+                (move if move >= 0 else None))
+
+    def store(self, board_hash, score, depth, flag, best_move):
+        """
+        Store an entry, the depth-preferred slot is only replaced by the same position, a stale entry or a deeper search
+        """
+        slot = (board_hash & self.bucket_mask) << 1
+        data = int(self.data[slot])
+        if data and int(self.checks[slot]) ^ data != board_hash and data & 0xFF == self.generation \
+                and depth < (data >> 19 & 0x7F) - 1:
+            slot += 1
+        data = ((round(score * TT_SCORE_SCALE) << 26) | (min(depth, 126) + 1) << 19 | flag << 17
+                | ((0 if best_move is None else best_move + 1) << 8) | self.generation)
+        self.data[slot] = data
+        self.checks[slot] = board_hash ^ data
+
+def release_shared_memory(block):
+    """
+    Unmap and delete a shared memory block owned by this process
+    """
+    block.close()
+    block.unlink()
+
+def get_worker_context():
+    """
+    Start method for the parallel search workers: fork when available so they inherit the shared table
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+# Helper process state for parallel search, kept between turns so killer/history tables and the attachment survive
+WORKER_AGENT = None
+# Seconds the main process waits for called off helpers to return their result
+WORKER_STOP_GRACE = 0.05
+
+def lazy_smp_worker(table_name, table_size, board_size, generation, player_bits, opponent_bits, optimized_weights,
+                    start_depth, time_limit, abort_token=None, pattern_evaluation=False, tuned_weights=None,
+                    probcut=False):
+    """
+    Body of a Lazy SMP (or pondering) helper process: iterative deepening on the shared table until time_limit,
+    or until the table's control token differs from abort_token, returns (best_move, best_score, depth) of its deepest
+    completed iteration
+    """
+    global WORKER_AGENT
+    agent = WORKER_AGENT
+    table = SHARED_TABLES.get(table_name)
+    if table is None:
+        table = TranspositionTable(table_size, board_size, shared_name=table_name)
+    if agent is None or agent.transposition_table is not table:
+        agent = StudentAgent(optimized_weights)
+        agent.transposition_table = table
+        WORKER_AGENT = agent
+
+    if (agent.optimized_weights, agent.tuned_weights) != (optimized_weights, tuned_weights or {}):
+        agent.evaluation_cache = None  # evaluated with other weights, reallocated by set_board_size
+    agent.optimized_weights = optimized_weights
+    agent.pattern_evaluation = pattern_evaluation
+    agent.tuned_weights = tuned_weights or {}
+    agent.probcut = probcut
+    agent.set_board_size(board_size)
+    table.generation = generation
+    agent.killer_moves = {}
+    agent.nodes_visited_total = 0
+    agent.leaf = 0
+    agent.time_limit = time_limit
+    agent.abort_token = abort_token
+    return agent.iterative_deepening(player_bits, opponent_bits, start_depth)
+
+class EvaluationState:
+    """
+    Evaluation terms of a SearchBoard kept up to date on every make/unmake
+    Only the played square, the flipped discs and the played square's neighbours are looked at for each move.
+    The tracked terms are the disc counts, the positional score (ours minus theirs), the mask of squares with at least
+    one empty neighbour, the frontier disc counts derived from it and the game phase index, and with a PatternSet
+    the table index of every pattern instance
+    """
+    def __init__(self, player_bits, opponent_bits, board_size, patterns=None):
+        geometry = get_board_geometry(board_size)
+        self.full_mask = geometry.full_mask
+        self.square_weights = geometry.positional_weights.ravel().tolist()
+        self.neighbour_masks = geometry.neighbour_masks
+        self.phase_indices = geometry.phase_indices
+
+        self.player_count = popcount(player_bits)
+        self.opponent_count = popcount(opponent_bits)
+        self.positional_score = 0
+        for weight, mask in geometry.positional_masks:
+            self.positional_score += weight * (popcount(player_bits & mask) - popcount(opponent_bits & mask))
+        self.empty_neighbours = bitboard_neighbours(self.full_mask & ~(player_bits | opponent_bits), board_size)
+        self.player_frontier = popcount(player_bits & self.empty_neighbours)
+        self.opponent_frontier = popcount(opponent_bits & self.empty_neighbours)
+        self.phase_index = self.phase_indices[self.player_count + self.opponent_count]
+
+        self.undo_states = [None] * (2 * board_size * board_size + 2)
+
+        self.pattern_indices = None
+        if patterns is not None:
+            self.pattern_refs = patterns.square_refs
+            self.pattern_indices = patterns.indices(player_bits, opponent_bits)
+            self.pattern_moves = [None] * len(self.undo_states)
+
+    def apply_move(self, ply, move, flips, player_bits, opponent_bits, player_moved):
+        """
+        Update the terms for a move that has just been played (player_bits/opponent_bits are the new position)
+        """
+        self.undo_states[ply] = (self.player_count, self.opponent_count, self.positional_score, self.empty_neighbours,
+                                 self.player_frontier, self.opponent_frontier, self.phase_index)
+
+        # Positional score: the new disc counts once, each flipped disc moves from one side to the other
+        square_weights = self.square_weights
+        positional_change = square_weights[move]
+        flipped = 0
+        remaining = flips
+        while remaining:
+            lowest = remaining & -remaining
+            positional_change += 2 * square_weights[lowest.bit_length() - 1]
+            flipped += 1
+            remaining ^= lowest
+
+        if player_moved:
+            self.player_count += flipped + 1
+            self.opponent_count -= flipped
+            self.positional_score += positional_change
+        else:
+            self.opponent_count += flipped + 1
+            self.player_count -= flipped
+            self.positional_score -= positional_change
+
+        # Only the neighbours of the filled square can lose their last empty neighbour
+        empty = self.full_mask & ~(player_bits | opponent_bits)
+        neighbour_masks = self.neighbour_masks
+        candidates = neighbour_masks[move] & self.empty_neighbours
+        while candidates:
+            lowest = candidates & -candidates
+            if not neighbour_masks[lowest.bit_length() - 1] & empty:
+                self.empty_neighbours ^= lowest
+            candidates ^= lowest
+
+        self.player_frontier = popcount(player_bits & self.empty_neighbours)
+        self.opponent_frontier = popcount(opponent_bits & self.empty_neighbours)
+        self.phase_index = self.phase_indices[self.player_count + self.opponent_count]
+
+        if self.pattern_indices is not None:
+            self.pattern_moves[ply] = (move, flips, player_moved)
+            # The played square goes from empty to the mover's digit, flipped discs from 2 to 1 or from 1 to 2
+            self.update_patterns(move, flips, 1 if player_moved else 2, -1 if player_moved else 1)
+
+    def undo_move(self, ply):
+        """
+        Restore the terms saved when the move at this ply was applied
+        """
+        (self.player_count, self.opponent_count, self.positional_score, self.empty_neighbours,
+         self.player_frontier, self.opponent_frontier, self.phase_index) = self.undo_states[ply]
+        if self.pattern_indices is not None:
+            move, flips, player_moved = self.pattern_moves[ply]
+            self.update_patterns(move, flips, -1 if player_moved else -2, 1 if player_moved else -1)
+
+    def update_patterns(self, move, flips, move_change, flip_change):
+        """
+        Add move_change to the digit of the played square and flip_change to the digits of the flipped discs in the
+        indices of every pattern instance containing them
+        """
+        indices = self.pattern_indices
+        refs = self.pattern_refs
+        for slot, power in refs[move]:
+            indices[slot] += move_change * power
+        while flips:
+            lowest = flips & -flips
+            for slot, power in refs[lowest.bit_length() - 1]:
+                indices[slot] += flip_change * power
+            flips ^= lowest
+
+class SearchBoard:
+    """
+    Mutable bitboard position used by the search
+    Moves are applied in place and undone from a preallocated undo stack, so the search never copies boards.
+    player_bits are always our discs and opponent_bits the opponent's, maximizing_player tells whose turn it is
+    """
+    def __init__(self, player_bits, opponent_bits, board_size, maximizing_player=True, patterns=None):
+        self.board_size = board_size
+        self.player_bits = player_bits
+        self.opponent_bits = opponent_bits
+        self.maximizing_player = maximizing_player
+        geometry = get_board_geometry(board_size)
+        self.zobrist_player = geometry.zobrist_player
+        self.zobrist_opponent = geometry.zobrist_opponent
+        self.zobrist_flip = geometry.zobrist_flip
+        self.board_hash = self.hash_board()
+        self.evaluation = EvaluationState(player_bits, opponent_bits, board_size, patterns)
+
+        # Every square can be played once and a pass can only follow a move, so 2 entries per square are enough
+        capacity = 2 * board_size * board_size + 2
+        self.undo_moves = [0] * capacity
+        self.undo_flips = [0] * capacity
+        self.undo_hashes = [0] * capacity
+        self.ply = 0
+
+    def hash_board(self):
+        """
+        Compute the Zobrist key of the position from scratch (make/unmake then keep it up to date incrementally)
+        """
+        board_hash = 0 if self.maximizing_player else ZOBRIST_SIDE
+        for square in squares_of(self.player_bits):
+            board_hash ^= self.zobrist_player[square]
+        for square in squares_of(self.opponent_bits):
+            board_hash ^= self.zobrist_opponent[square]
+        return board_hash
+
+    def get_valid_moves(self):
+        """
+        Get the mask of legal moves for the side to move
+        """
+        if self.maximizing_player:
+            return bitboard_valid_moves(self.player_bits, self.opponent_bits, self.board_size)
+        return bitboard_valid_moves(self.opponent_bits, self.player_bits, self.board_size)
+
+    def get_opponent_moves(self):
+        """
+        Get the mask of legal moves for the side not to move
+        """
+        if self.maximizing_player:
+            return bitboard_valid_moves(self.opponent_bits, self.player_bits, self.board_size)
+        return bitboard_valid_moves(self.player_bits, self.opponent_bits, self.board_size)
+
+    def disc_hash(self):
+        """
+        Zobrist key of the discs alone, without the side to move
+        """
+        return self.board_hash if self.maximizing_player else self.board_hash ^ ZOBRIST_SIDE
+
+    def get_flipped_positions(self, move):
+        """
+        Get the mask of discs that would be flipped if the side to move plays the move
+        """
+        if self.maximizing_player:
+            return bitboard_flips(self.player_bits, self.opponent_bits, move, self.board_size)
+        return bitboard_flips(self.opponent_bits, self.player_bits, move, self.board_size)
+
+    def make_move(self, move):
+        """
+        Play the move for the side to move in place, record it on the undo stack and return the flipped discs
+        """
+        ply = self.ply
+        board_hash = self.board_hash
+        self.undo_moves[ply] = move
+        self.undo_hashes[ply] = board_hash
+
+        if self.maximizing_player:
+            flips = bitboard_flips(self.player_bits, self.opponent_bits, move, self.board_size)
+            self.player_bits |= (1 << move) | flips
+            self.opponent_bits ^= flips
+            board_hash ^= self.zobrist_player[move]
+        else:
+            flips = bitboard_flips(self.opponent_bits, self.player_bits, move, self.board_size)
+            self.opponent_bits |= (1 << move) | flips
+            self.player_bits ^= flips
+            board_hash ^= self.zobrist_opponent[move]
+        self.undo_flips[ply] = flips
+        self.evaluation.apply_move(ply, move, flips, self.player_bits, self.opponent_bits, self.maximizing_player)
+
+        # Flipping a disc swaps its key from one owner to the other
+        zobrist_flip = self.zobrist_flip
+        remaining = flips
+        while remaining:
+            lowest = remaining & -remaining
+            board_hash ^= zobrist_flip[lowest.bit_length() - 1]
+            remaining ^= lowest
+
+        self.board_hash = board_hash ^ ZOBRIST_SIDE
+        self.maximizing_player = not self.maximizing_player
+        self.ply = ply + 1
+        return flips
+
+    def pass_turn(self):
+        """
+        Give the turn to the other side without playing, undone with unmake_move like a normal move
+        """
+        ply = self.ply
+        self.undo_moves[ply] = -1
+        self.undo_flips[ply] = 0
+        self.undo_hashes[ply] = self.board_hash
+        self.board_hash ^= ZOBRIST_SIDE
+        self.maximizing_player = not self.maximizing_player
+        self.ply = ply + 1
+
+    def unmake_move(self):
+        """
+        Restore the position exactly as it was before the last make_move or pass_turn
+        """
+        ply = self.ply - 1
+        self.ply = ply
+        move = self.undo_moves[ply]
+        flips = self.undo_flips[ply]
+        self.board_hash = self.undo_hashes[ply]
+        self.maximizing_player = not self.maximizing_player
+        if move < 0:
+            return
+        self.evaluation.undo_move(ply)
+        if self.maximizing_player:
+            self.player_bits ^= (1 << move) | flips
+            self.opponent_bits |= flips
+        else:
+            self.opponent_bits ^= (1 << move) | flips
+            self.player_bits |= flips
+
+# Batched numpy evaluation
+# The same 8 heuristics as evaluate_board, computed for a whole stack of boards (N, n, n) with shifted copies of the
+# stack instead of per-square python loops, so the interpreter overhead is paid once per batch
+
+def batch_shift(boards, dx, dy):
+    """
+    Shift a stack of boards so that out[:, r, c] == boards[:, r + dx, c + dy], squares shifted in from outside are 0
+    """
+    board_size = boards.shape[1]
+    shifted = np.zeros_like(boards)
+    if abs(dx) >= board_size or abs(dy) >= board_size:
+        return shifted
+    rows_out = slice(max(-dx, 0), board_size - max(dx, 0))
+    cols_out = slice(max(-dy, 0), board_size - max(dy, 0))
+    rows_in = slice(max(dx, 0), board_size - max(-dx, 0))
+    cols_in = slice(max(dy, 0), board_size - max(-dy, 0))
+    shifted[:, rows_out, cols_out] = boards[:, rows_in, cols_in]
+    return shifted
+
+def batch_neighbour_counts(mask):
+    """
+    Count for every square how many of its 8 neighbours are set (a 3x3 convolution without the centre)
+    """
+    counts = np.zeros(mask.shape, dtype=np.int16)
+    for dx, dy in get_directions():
+        counts += batch_shift(mask, dx, dy)
+    return counts
+
+def batch_valid_moves(own, opp, empty):
+    """
+    Get the boolean mask of legal moves of own for every board of the stack
+    """
+    board_size = own.shape[1]
+    moves = np.zeros(own.shape, dtype=bool)
+    for dx, dy in get_directions():
+        # run marks the squares whose first (distance - 1) squares in this direction all hold opponent discs
+        run = batch_shift(opp, dx, dy)
+        for distance in range(2, board_size):
+            if not run.any():
+                break
+            moves |= run & batch_shift(own, dx * distance, dy * distance)
+            run &= batch_shift(opp, dx * distance, dy * distance)
+    return moves & empty
+
+def bitboard_to_array(bits, board_size):
+    """
+    Boolean (n, n) array of the squares set in a bitboard
+    """
+    squares = np.zeros(board_size * board_size, dtype=bool)
+    squares[squares_of(bits)] = True
+    return squares.reshape(board_size, board_size)
+
+def batch_stability(own, opp):
+    """
+    Count the stable discs of own for every board of the stack, the same analysis as bitboard_stability
+    """
+    board_size = own.shape[1]
+    tables = get_stability_tables(board_size)
+    powers = 3 ** np.arange(board_size)
+    bits = np.arange(board_size)
+
+    stable = np.zeros(own.shape, dtype=bool)
+    for edge in [(slice(None), 0, slice(None)), (slice(None), -1, slice(None)),
+                 (slice(None), slice(None), 0), (slice(None), slice(None), -1)]:
+        if tables.edge is None:
+            # corner_run_stable: the whole edge when it is full, else the runs of own discs from both ends
+            own_line = own[edge]
+            runs = np.cumprod(own_line, axis=1) | np.cumprod(own_line[:, ::-1], axis=1)[:, ::-1]
+            stable[edge] |= np.where((own_line | opp[edge]).all(axis=1)[:, np.newaxis], own_line, runs.astype(bool))
+            continue
+        index = own[edge].astype(np.int64) @ powers + 2 * (opp[edge].astype(np.int64) @ powers)
+        stable[edge] |= (np.frombuffer(tables.edge, dtype=np.uint16)[index][:, np.newaxis] >> bits & 1).astype(bool)
+
+    # Per axis, the squares that cannot be flipped along it: border squares and full lines
+    occupied = own | opp
+    settled = []
+    for wall, lines in zip(tables.axis_walls, tables.axis_lines):
+        axis_settled = np.broadcast_to(bitboard_to_array(wall, board_size), own.shape).copy()
+        for line in lines:
+            line_squares = bitboard_to_array(line, board_size)
+            axis_settled[occupied[:, line_squares].all(axis=1)] |= line_squares
+        settled.append(axis_settled)
+    stable |= own & settled[0] & settled[1] & settled[2] & settled[3]
+
+    while True:
+        grown = own & ~stable
+        for (forward, backward), axis_settled in zip(STABILITY_AXES, settled):
+            # A stable disc next to the square on either side of the axis
+            grown &= axis_settled | batch_shift(stable, *forward) | batch_shift(stable, *backward)
+        if not grown.any():
+            return stable.sum(axis=(1, 2))
+        stable |= grown
+
+def batch_features(boards, player, opponent):
+    """
+    Compute the 8 heuristic terms of evaluate_board for a stack of boards (N, n, n), from player's point of view
+    Returns the (N, 8) features in evaluate_board's order, the phase index (0, 7 or 14) of each board and whether the
+    opponent has no legal move (forcing move bonus)
+    """
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+        boards = boards[np.newaxis]
+    board_size = boards.shape[1]
+    total_squares = board_size * board_size
+    own = boards == player
+    opp = boards == opponent
+    empty = boards == 0
+
+    player_pieces = own.sum(axis=(1, 2))
+    opponent_pieces = opp.sum(axis=(1, 2))
+    total_discs = player_pieces + opponent_pieces
+    phase_indices = np.where(total_discs <= total_squares * 0.25, 0, np.where(total_discs <= total_squares * 0.75, 7, 14))
+
+    corner_mask = np.zeros((board_size, board_size), dtype=bool)
+    corner_mask[[0, 0, -1, -1], [0, -1, 0, -1]] = True
+
+    player_moves = batch_valid_moves(own, opp, empty).sum(axis=(1, 2))
+    opponent_moves = batch_valid_moves(opp, own, empty).sum(axis=(1, 2))
+    move_total = player_moves + opponent_moves
+    mobility = np.divide(100 * (player_moves - opponent_moves), move_total,
+                         out=np.zeros(len(boards)), where=move_total != 0)
+
+    empty_neighbours = batch_neighbour_counts(empty) > 0
+    opponent_neighbours = batch_neighbour_counts(opp) > 0
+    positional_weights = get_positional_weights(board_size)
+
+    features = np.empty((len(boards), 8), dtype=np.float64)
+    features[:, 0] = player_pieces - opponent_pieces
+    features[:, 1] = (own & corner_mask).sum(axis=(1, 2)) - (opp & corner_mask).sum(axis=(1, 2))
+    features[:, 2] = mobility
+    features[:, 3] = batch_stability(own, opp) - batch_stability(opp, own)
+    features[:, 4] = (own & empty_neighbours).sum(axis=(1, 2)) - (opp & empty_neighbours).sum(axis=(1, 2))
+    features[:, 5] = np.where((total_squares - total_discs) % 2 == 0, 1, -1)
+    features[:, 6] = np.tensordot(own.astype(np.int64) - opp, positional_weights, axes=([1, 2], [0, 1]))
+    features[:, 7] = (empty & opponent_neighbours).sum(axis=(1, 2))
+    return features, phase_indices, opponent_moves == 0
+
+def batch_pattern_indices(boards, player, opponent, patterns):
+    """
+    Table indices (offsets included) of every pattern instance for a stack of boards (N, n, n), shape (N, instances)
+    """
+    flat = np.asarray(boards).reshape(len(boards), -1)
+    digits = (flat == player).astype(np.int64) + 2 * (flat == opponent)
+    indices = np.empty((len(flat), len(patterns.instances)), dtype=np.int64)
+    for slot, ((type_number, squares), offset) in enumerate(zip(patterns.instances, patterns.instance_offsets)):
+        indices[:, slot] = digits[:, squares] @ 3 ** np.arange(len(squares)) + offset
+    return indices
+
+# Monte Carlo tree search
+# The engine selected with StudentAgent(engine="mcts"). Playouts run many games at once on stacks of boards stored
+# as one n-bit mask per row, (N, n) uint16 arrays of the side to move's and the other side's discs: a shift in any of
+# the 8 directions is a bit shift of the rows and/or a shift of the row index, so every step of the playouts costs a
+# few numpy operations for the whole batch. The tree lives in preallocated arrays, a node's children being a
+# contiguous block, and its positions are replayed from the root during the descent instead of being stored
+MCTS_BATCH_SIZE = 64
+MCTS_TREE_NODES = 1 << 20
+# The first batch of a turn is this small, to time the playouts before committing to full batches
+MCTS_FIRST_BATCH_SIZE = 8
+# Seconds before the turn's deadline by which the last batch must be predicted to finish (choosing the move and the
+# variance of the batch durations under load)
+MCTS_SAFETY_MARGIN = 0.1
+# Exploration constants of the UCT and PUCT selection rules (results are in [0, 1])
+MCTS_EXPLORATION = {"uct": 0.7, "puct": 1.5}
+# PUCT value of an unvisited child: its parent's value lowered by this much
+MCTS_FIRST_PLAY_REDUCTION = 0.1
+# Priors are a softmax of the static move ordering scores divided by this temperature
+MCTS_PRIOR_TEMPERATURE = 200
+# Playout moves are drawn with probability proportional to exp(positional weight / temperature), None for uniform
+MCTS_ROLLOUT_TEMPERATURE = 40
+
+POPCOUNT_16 = np.unpackbits(np.arange(1 << 16, dtype=">u2").view(np.uint8)).reshape(-1, 16).sum(axis=1).astype(np.int64)
+
+def predict_batch_seconds(durations, batch_size):
+    """
+    Predicted seconds of an MCTS batch of batch_size simulations from the turn's measured {batch size: seconds}.
+    The playout plies cost the same however many games they carry, so a batch is a fixed overhead plus a little per
+    simulation, fitted on the smallest and largest sizes measured (with one size, proportional above it)
+    """
+    if not durations:
+        return 0.0
+    small, large = min(durations), max(durations)
+    if small == large:
+        return durations[small] * max(1.0, batch_size / small)
+    per_simulation = max(durations[large] - durations[small], 0.0) / (large - small)
+    overhead = max(durations[small] - small * per_simulation, 0.0)
+    return overhead + batch_size * per_simulation
+
+def bits_to_rows(bits, board_size):
+    """
+    Row masks of a bitboard, bit c of row r being square (r, c)
+    """
+    row_mask = (1 << board_size) - 1
+    return [bits >> (row * board_size) & row_mask for row in range(board_size)]
+
+def rows_shift(rows, dx, dy, row_mask, distance=1):
+    """
+    Move every disc of a stack of row mask boards (N, n) distance squares in direction (dx, dy), discs leaving the
+    board are dropped
+    """
+    if dy == 1:
+        rows = (rows << distance) & row_mask
+    elif dy == -1:
+        rows = rows >> distance
+    if dx == 0:
+        return rows
+    shifted = np.zeros_like(rows)
+    if dx == 1:
+        shifted[:, distance:] = rows[:, :-distance]
+    else:
+        shifted[:, :-distance] = rows[:, distance:]
+    return shifted
+
+def rows_run_fill(start, opp, dx, dy, row_mask, board_size):
+    """
+    start extended in direction (dx, dy) through the opponent's discs of each board (Kogge-Stone fill: the run
+    length doubles at each step, so log2(n) steps cover any run)
+    """
+    distance = 1
+    while distance < board_size - 2:
+        start |= opp & rows_shift(start, dx, dy, row_mask, distance)
+        opp = opp & rows_shift(opp, dx, dy, row_mask, distance)
+        distance *= 2
+    return start
+
+def rows_valid_moves(own, opp, row_mask, board_size):
+    """
+    Row masks of the legal moves of own for every board of the stack
+    """
+    empty = ~(own | opp) & row_mask
+    moves = np.zeros_like(own)
+    for dx, dy in get_directions():
+        # The runs of opponent discs starting next to an own disc, the square after them is a move if empty
+        runs = rows_run_fill(rows_shift(own, dx, dy, row_mask) & opp, opp, dx, dy, row_mask, board_size)
+        moves |= rows_shift(runs, dx, dy, row_mask) & empty
+    return moves
+
+def rows_flips(own, opp, move_rows, row_mask, board_size):
+    """
+    Row masks of the discs flipped by the move of each board (move_rows holds one square per board, or none)
+    """
+    flips = np.zeros_like(own)
+    for dx, dy in get_directions():
+        run = rows_run_fill(rows_shift(move_rows, dx, dy, row_mask) & opp, opp, dx, dy, row_mask, board_size)
+        # The run is flipped on the boards where an own disc closes it
+        closed = (rows_shift(run, dx, dy, row_mask) & own).any(axis=1)
+        flips |= run * closed[:, np.newaxis].astype(np.uint16)
+    return flips
+
+def batch_playouts(own, opp, board_size, square_weights=None):
+    """
+    Play every position of a stack (N, n) of row mask boards (own: the side to move's discs) to the end of the game,
+    each move drawn among the legal ones uniformly or with probability proportional to square_weights (n * n).
+    Returns the final disc differences from the point of view of each position's side to move
+    """
+    count = len(own)
+    total_squares = board_size * board_size
+    row_mask = np.uint16((1 << board_size) - 1)
+    own, opp = own.astype(np.uint16), opp.astype(np.uint16)
+    bit_positions = np.arange(board_size, dtype=np.uint16)
+    boards = np.arange(count)
+    sign = np.ones(count, dtype=np.int64)  # 1 when the side to move is the one of the starting position
+    passes = np.zeros(count, dtype=np.int64)
+    while (passes < 2).any():
+        moves = rows_valid_moves(own, opp, row_mask, board_size)
+        legal = (moves[:, :, np.newaxis] >> bit_positions & 1).reshape(count, total_squares).astype(bool)
+        has_move = legal.any(axis=1)
+        # Weighted draw: the largest log(u) / weight is a sample proportional to the weights
+        keys = np.random.random((count, total_squares))
+        if square_weights is not None:
+            keys = np.log(keys) / square_weights
+        squares = np.where(legal, keys, -np.inf).argmax(axis=1)
+
+        move_rows = np.zeros_like(own)
+        playing = boards[has_move]
+        move_rows[playing, squares[playing] // board_size] = np.left_shift(1, squares[playing] % board_size)
+        flips = rows_flips(own, opp, move_rows, row_mask, board_size)
+        own, opp = opp & ~flips, own | move_rows | flips  # the other side is to move (or passes) next
+        sign = -sign
+        passes = np.where(has_move, 0, passes + 1)
+    return sign * (POPCOUNT_16[own].sum(axis=1) - POPCOUNT_16[opp].sum(axis=1))
+
+class MCTSTree:
+    """
+    Search tree of the MCTS engine in preallocated arrays, node 0 being the root (root_position, us to move).
+    For each node: the move leading to it (-1 for a pass), its parent, its prior, visit count and sum of results from
+    the point of view of the side that played its move, and its children as first_child and child_count (-1 when not
+    expanded yet, 0 at the end of the game)
+    """
+    def __init__(self, capacity, board_size, player_bits, opponent_bits):
+        self.capacity = capacity
+        self.board_size = board_size
+        self.root_position = (player_bits, opponent_bits)
+        self.moves = np.full(capacity, -1, dtype=np.int16)
+        self.parents = np.full(capacity, -1, dtype=np.int32)
+        self.priors = np.zeros(capacity, dtype=np.float32)
+        self.visits = np.zeros(capacity, dtype=np.float64)
+        self.value_sums = np.zeros(capacity, dtype=np.float64)
+        self.first_child = np.zeros(capacity, dtype=np.int32)
+        self.child_counts = np.full(capacity, -1, dtype=np.int16)
+        self.size = 1
+
+    def expand(self, node, moves, priors):
+        """
+        Give a node its children, returns False when the tree is full (the node stays a leaf)
+        """
+        start, end = self.size, self.size + len(moves)
+        if end > self.capacity:
+            return False
+        self.moves[start:end] = moves
+        self.parents[start:end] = node
+        self.priors[start:end] = priors
+        self.visits[start:end] = 0
+        self.value_sums[start:end] = 0
+        self.child_counts[start:end] = -1
+        self.first_child[node] = start
+        self.child_counts[node] = len(moves)
+        self.size = end
+        return True
+
+    def select_child(self, node, rule, exploration):
+        """
+        The child of an expanded node to descend to: UCT (unvisited children first, by prior) or PUCT
+        """
+        start = self.first_child[node]
+        end = start + self.child_counts[node]
+        visits = self.visits[start:end]
+        values = self.value_sums[start:end] / np.maximum(visits, 1)
+        parent_visits = self.visits[node]
+        if rule == "uct":
+            scores = values + exploration * np.sqrt(np.log(max(parent_visits, 1)) / np.maximum(visits, 1))
+            scores = np.where(visits > 0, scores, 1e9 + self.priors[start:end])
+        else:
+            parent_value = 1 - self.value_sums[node] / max(parent_visits, 1)  # for the side to move at the node
+            values = np.where(visits > 0, values, parent_value - MCTS_FIRST_PLAY_REDUCTION)
+            scores = values + exploration * self.priors[start:end] * np.sqrt(parent_visits) / (1 + visits)
+        return start + int(scores.argmax())
+
+    def best_child(self, node=0):
+        """
+        The most visited child of an expanded node
+        """
+        start = self.first_child[node]
+        return start + int(self.visits[start:start + self.child_counts[node]].argmax())
+
+    def principal_line(self):
+        """
+        Moves of the most visited line from the root
+        """
+        line = []
+        node = 0
+        while self.child_counts[node] > 0 and self.visits[node] > 1:
+            node = self.best_child(node)
+            line.append(int(self.moves[node]))
+        return line
+
+    def advance_to(self, player_bits, opponent_bits):
+        """
+        Make the node of this position (us to move) at most two plies below the root the new root, keeping its subtree
+        and dropping the rest. Returns False when the position is not in the tree
+        """
+        if (player_bits, opponent_bits) == self.root_position:
+            return True
+        board_size = self.board_size
+        mover_bits, other_bits = self.root_position
+        for child in self.children(0):
+            move = int(self.moves[child])
+            # After our move the opponent is to move, then us again
+            if move < 0:
+                child_position = (other_bits, mover_bits)
+            else:
+                child_position = play(mover_bits, other_bits, move, board_size)
+            for grandchild in self.children(child):
+                reply = int(self.moves[grandchild])
+                if reply < 0:
+                    grandchild_position = child_position[::-1]
+                else:
+                    grandchild_position = play(*child_position, reply, board_size)
+                if grandchild_position == (player_bits, opponent_bits):
+                    self.reroot(grandchild)
+                    self.root_position = (player_bits, opponent_bits)
+                    return True
+        return False
+
+    def children(self, node):
+        if self.child_counts[node] <= 0:
+            return range(0)
+        return range(self.first_child[node], self.first_child[node] + self.child_counts[node])
+
+    def reroot(self, new_root):
+        """
+        Compact the subtree of new_root to the front of the arrays, in the same order so that children blocks stay
+        contiguous and after their parent
+        """
+        size = self.size
+        parents = self.parents[:size]
+        keep = np.zeros(size, dtype=bool)
+        keep[new_root] = True
+        # Parents come before their children: marking the nodes whose parent is kept, one level per pass
+        while True:
+            grown = keep | ((parents >= 0) & keep[np.maximum(parents, 0)])
+            if grown.sum() == keep.sum():
+                break
+            keep = grown
+        new_index = np.cumsum(keep) - 1
+        kept = int(keep.sum())
+        for buffer in (self.moves, self.priors, self.visits, self.value_sums, self.child_counts):
+            buffer[:kept] = buffer[:size][keep]
+        old_parents = parents[keep]
+        self.parents[:kept] = np.where(old_parents >= 0, new_index[np.maximum(old_parents, 0)], -1)
+        self.parents[0] = -1
+        old_first_child = self.first_child[:size][keep]
+        self.first_child[:kept] = np.where(self.child_counts[:kept] > 0,
+                                           new_index[np.minimum(old_first_child, size - 1)], 0)
+        self.moves[0] = -1
+        self.size = kept
+
 def print_all_matrices():
     """
-    Generate and print positional weights for board sizes 6x6, 8x8, 10x10, and 12x12.
+    Generate and print positional weights for every supported board size, 4x4 to 16x16.
     """
-    board_sizes = [6, 8, 10, 12]
-    for size in board_sizes:
+    for size in BOARD_SIZES:
         print(f"Positional Weights for {size}x{size} Board:\n")
         print(np.array(get_positional_weights(size)))
         print("\n")
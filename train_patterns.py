@@ -0,0 +1,132 @@
+# Pattern table trainer: fits the pattern evaluation tables of student_agent.py on self-play games
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.train_patterns --board_size 8 --games 2000 --depth 2
+import argparse
+import os
+import random
+import time
+import numpy as np
+from agents.student_agent import (StudentAgent, BOARD_SIZES, PatternSet, PATTERN_PHASES, pattern_path,
+                                  batch_pattern_indices, bitboard_valid_moves, initial_position, play, squares_of,
+                                  popcount)
+
+def to_board(mover_bits, other_bits, board_size):
+    """
+    Numpy board with the mover as 1 and the other side as 2
+    """
+    board = np.zeros(board_size * board_size, dtype=np.int8)
+    board[squares_of(mover_bits)] = 1
+    board[squares_of(other_bits)] = 2
+    return board.reshape(board_size, board_size)
+
+def generate_positions(board_size, games, depth, epsilon, seed):
+    """
+    Self-play games of the handcrafted evaluation searched to a fixed depth, with a random move instead of the
+    searched one with probability epsilon. Returns every position (mover as 1) and the final disc difference for its
+    mover
+    """
+    rng = random.Random(seed)
+    agent = StudentAgent()
+    agent.use_opening_book = False
+    agent.set_board_size(board_size)
+    agent.time_limit = float('inf')
+    boards, labels = [], []
+    for game in range(games):
+        mover_bits, other_bits = initial_position(board_size)
+        game_positions = []  # (board, whether the first player is to move)
+        first_to_move = True
+        while True:
+            moves = squares_of(bitboard_valid_moves(mover_bits, other_bits, board_size))
+            if not moves:
+                if not bitboard_valid_moves(other_bits, mover_bits, board_size):
+                    break
+                mover_bits, other_bits = other_bits, mover_bits
+                first_to_move = not first_to_move
+                continue
+            game_positions.append((to_board(mover_bits, other_bits, board_size), first_to_move))
+            if rng.random() < epsilon:
+                move = moves[rng.randrange(len(moves))]
+            else:
+                agent.killer_moves = {}
+                agent.transposition_table.new_search()
+                move, score = agent.alpha_beta_search(mover_bits, other_bits, depth)
+            mover_bits, other_bits = play(mover_bits, other_bits, move, board_size)
+            first_to_move = not first_to_move
+
+        # mover_bits belong to the side to move when the game ended
+        difference = popcount(mover_bits) - popcount(other_bits)
+        first_difference = difference if first_to_move else -difference
+        for board, first in game_positions:
+            boards.append(board)
+            labels.append(first_difference if first else -first_difference)
+        if (game + 1) % 50 == 0:
+            print(f"{game + 1}/{games} games, {len(boards)} positions", flush=True)
+    return np.array(boards), np.array(labels, dtype=np.float32)
+
+def fit_tables(patterns, boards, labels, epochs, regularization):
+    """
+    Least squares fit of the tables and tempo bonuses of each phase. Every position is used from both sides: as is
+    with the side to move's tempo, and with the colours swapped, the opposite label and the tempo against us.
+    Each epoch moves every table entry by the mean residual of the positions using it, divided by the number of
+    instances sharing those positions (regularization adds virtual positions with no residual to rare entries)
+    """
+    total_size = sum(patterns.sizes)
+    instances = len(patterns.instances)
+    indices = np.concatenate([batch_pattern_indices(boards, 1, 2, patterns),
+                              batch_pattern_indices(boards, 2, 1, patterns)])
+    targets = np.concatenate([labels, -labels])
+    sides = np.concatenate([np.ones(len(labels)), -np.ones(len(labels))])
+    discs = np.count_nonzero(boards, axis=(1, 2))
+    phases = np.tile(np.array(patterns.phase_of)[discs], 2)
+
+    tables = np.zeros((PATTERN_PHASES, total_size), dtype=np.float64)
+    tempo = np.zeros(PATTERN_PHASES, dtype=np.float64)
+    for phase in range(PATTERN_PHASES):
+        rows = phases == phase
+        if not rows.any():
+            continue
+        phase_indices, phase_targets, phase_sides = indices[rows], targets[rows], sides[rows]
+        counts = np.bincount(phase_indices.ravel(), minlength=total_size)
+        table = tables[phase]
+        for epoch in range(epochs):
+            residuals = phase_targets - table[phase_indices].sum(axis=1) - tempo[phase] * phase_sides
+            sums = np.bincount(phase_indices.ravel(), weights=np.repeat(residuals, instances), minlength=total_size)
+            table += sums / (counts + regularization) / instances
+            tempo[phase] += np.mean(residuals * phase_sides)
+        residuals = phase_targets - table[phase_indices].sum(axis=1) - tempo[phase] * phase_sides
+        print(f"phase {phase}: {rows.sum()} positions, rms error {np.sqrt(np.mean(residuals ** 2)):.2f} discs",
+              flush=True)
+    return tables, tempo
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the pattern evaluation tables of the student agent")
+    parser.add_argument("--board_size", type=int, default=8, choices=BOARD_SIZES)
+    parser.add_argument("--games", type=int, default=1000, help="number of self-play games")
+    parser.add_argument("--depth", type=int, default=2, help="search depth of the self-play moves")
+    parser.add_argument("--epsilon", type=float, default=0.1, help="probability of a random move")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--regularization", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--positions", default=None,
+                        help="npz file of generated positions, reused if it exists, written otherwise")
+    parser.add_argument("--output", default=None, help="tables file (default: the one the agent loads)")
+    args = parser.parse_args()
+
+    patterns = PatternSet(args.board_size)
+    start_time = time.time()
+    if args.positions and os.path.exists(args.positions):
+        with np.load(args.positions) as data:
+            boards, labels = data["boards"], data["labels"]
+    else:
+        boards, labels = generate_positions(args.board_size, args.games, args.depth, args.epsilon, args.seed)
+        if args.positions:
+            np.savez_compressed(args.positions, boards=boards, labels=labels)
+    print(f"{len(boards)} positions in {time.time() - start_time:.1f}s", flush=True)
+
+    tables, tempo = fit_tables(patterns, boards, labels, args.epochs, args.regularization)
+    path = args.output or pattern_path(args.board_size)
+    patterns.write(path, tables, tempo)
+    print(f"{path}: {len(patterns.instances)} pattern instances, {tables.shape[1]} entries per phase")
+
+if __name__ == "__main__":
+    main()
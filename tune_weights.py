@@ -0,0 +1,213 @@
+# Evaluation weight tuner: fits the weights of the 8 heuristics of student_agent.py on self-play positions (Texel method)
+# Put this file next to student_agent.py (in the agents folder) and run from the project root, for example:
+# python -m agents.tune_weights collect --board_size 8 --games 4000 --output positions_8x8.npz
+# python -m agents.tune_weights features --positions positions_8x8.npz --output features_8x8.npz
+# python -m agents.tune_weights fit --features features_8x8.npz --output weights.json
+# then StudentAgent(weights_path="agents/weights.json") plays with the tuned weights
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from agents.student_agent import (StudentAgent, BOARD_SIZES, FEATURE_NAMES, PHASE_NAMES, batch_features,
+                                  get_worker_context)
+from agents.train_patterns import generate_positions
+
+# Bonus evaluate_board gives when the opponent has no legal move, kept fixed by the fit
+FORCING_MOVE_BONUS = 1000
+NEWTON_ITERATIONS = 30
+
+def collect_chunk(board_size, games, depth, epsilon, seed):
+    return generate_positions(board_size, games, depth, epsilon, seed)
+
+def collect(board_size, games, depth, epsilon, seed, workers):
+    """
+    Self-play positions (mover as 1) and final disc differences for the mover, games split over the worker pool
+    """
+    chunks = [games // workers + (index < games % workers) for index in range(workers)]
+    with ProcessPoolExecutor(workers, mp_context=get_worker_context()) as pool:
+        results = list(pool.map(collect_chunk, [board_size] * workers, chunks, [depth] * workers,
+                                [epsilon] * workers, [seed + index * 1000003 for index in range(workers)]))
+    results = [(boards, labels) for boards, labels in results if len(boards)]
+    return np.concatenate([boards for boards, labels in results]), np.concatenate([labels for boards, labels in results])
+
+def features_chunk(boards, labels):
+    """
+    Features of a chunk of positions from both sides: the mover's (player 1) and the other side's (player 2), with
+    the game result of that side (1 win, 0.5 draw, 0 loss)
+    """
+    features, phases, blocked, results = [], [], [], []
+    for player, sign in ((1, 1), (2, -1)):
+        chunk_features, chunk_phases, chunk_blocked = batch_features(boards, player, 3 - player)
+        features.append(chunk_features)
+        phases.append(chunk_phases)
+        blocked.append(chunk_blocked)
+        results.append((np.sign(sign * labels) + 1) / 2)
+    return np.concatenate(features), np.concatenate(phases), np.concatenate(blocked), np.concatenate(results)
+
+def extract_features(boards, labels, workers, chunk_size=20000):
+    """
+    Feature vectors of every position with batch_features, in chunks over the worker pool
+    """
+    starts = range(0, len(boards), chunk_size)
+    with ProcessPoolExecutor(workers, mp_context=get_worker_context()) as pool:
+        chunks = list(pool.map(features_chunk, [boards[start:start + chunk_size] for start in starts],
+                               [labels[start:start + chunk_size] for start in starts]))
+    return tuple(np.concatenate([chunk[part] for chunk in chunks]) for part in range(4))
+
+def log_loss(logits, results):
+    """
+    Mean cross-entropy of the predicted win probabilities sigmoid(logits) against the results
+    """
+    return np.mean(np.logaddexp(0, logits) - results * logits)
+
+def fit_scale(scores, results):
+    """
+    Scale K of the win probability sigmoid(K * score) that best fits the results with the current weights, found by
+    Newton's method on the log loss. It converts evaluation points to logits and back
+    """
+    scale = 1 / max(np.std(scores), 1e-9)
+    for iteration in range(NEWTON_ITERATIONS):
+        probabilities = 1 / (1 + np.exp(-scale * scores))
+        gradient = np.sum((probabilities - results) * scores)
+        hessian = np.sum(probabilities * (1 - probabilities) * scores ** 2)
+        step = gradient / max(hessian, 1e-12)
+        scale = max(scale - step, scale / 10)
+        if abs(step) < 1e-9 * scale:
+            break
+    return scale
+
+def fit_phase(features, offsets, results, prior, regularization):
+    """
+    Logistic regression of the results on the features of one phase: the logit is features @ coefficients + offsets,
+    with an L2 penalty pulling each coefficient (in units of its feature's standard deviation) towards the prior.
+    Newton's method with step halving, returns the coefficients
+    """
+    count = len(results)
+    if not count:
+        return prior
+    spread = np.maximum(features.std(axis=0), 1e-9)
+    penalty = regularization * count * spread ** 2
+
+    def objective(coefficients):
+        logits = features @ coefficients + offsets
+        return log_loss(logits, results) * count + 0.5 * np.sum(penalty * (coefficients - prior) ** 2)
+
+    coefficients = prior.copy()
+    loss = objective(coefficients)
+    for iteration in range(NEWTON_ITERATIONS):
+        probabilities = 1 / (1 + np.exp(-(features @ coefficients + offsets)))
+        gradient = features.T @ (probabilities - results) + penalty * (coefficients - prior)
+        hessian = (features * (probabilities * (1 - probabilities))[:, np.newaxis]).T @ features + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        while True:
+            candidate = coefficients - step
+            candidate_loss = objective(candidate)
+            if candidate_loss <= loss or np.max(np.abs(step)) < 1e-12:
+                break
+            step /= 2
+        converged = loss - candidate_loss < 1e-9 * count
+        coefficients, loss = candidate, candidate_loss
+        if converged:
+            break
+    return coefficients
+
+def fit(board_size, features, phases, blocked, results, regularization, workers):
+    """
+    Tuned weights {phase_index: 8 weights} of a board size. The current weights give the logit scale and the prior;
+    the phases are fitted independently, in parallel. Weights stay in evaluation points so the forcing move bonus
+    and the search's score windows keep their meaning
+    """
+    agent = StudentAgent()
+    current = agent.get_phase_weights(board_size)
+    weights = np.array([current[phase_index] for phase_index in PHASE_NAMES], dtype=np.float64)
+    phase_rows = phases // 7
+    scores = np.einsum('ij,ij->i', features, weights[phase_rows]) + FORCING_MOVE_BONUS * blocked
+    scale = fit_scale(scores, results)
+    print(f"logit scale {scale:.6f}, log loss with the current weights {log_loss(scale * scores, results):.5f}",
+          flush=True)
+
+    tasks = []
+    for row, phase_index in enumerate(PHASE_NAMES):
+        rows = phase_rows == row
+        tasks.append((features[rows] * scale, scale * FORCING_MOVE_BONUS * blocked[rows], results[rows],
+                      weights[row], regularization))
+    with ProcessPoolExecutor(workers, mp_context=get_worker_context()) as pool:
+        futures = [pool.submit(fit_phase, *task) for task in tasks]
+        tuned = {phase_index: future.result() for phase_index, future in zip(PHASE_NAMES, futures)}
+
+    for row, (phase_index, coefficients) in enumerate(tuned.items()):
+        phase_features, offsets, phase_results, prior, _ = tasks[row]
+        if not len(phase_results):
+            continue
+        print(f"{PHASE_NAMES[phase_index]}: {len(phase_results)} positions, log loss "
+              f"{log_loss(phase_features @ prior + offsets, phase_results):.5f} -> "
+              f"{log_loss(phase_features @ coefficients + offsets, phase_results):.5f}", flush=True)
+    return {phase_index: coefficients for phase_index, coefficients in tuned.items()}
+
+def write_weights(path, board_size, tuned):
+    """
+    Write (or update) a tuned weights file with the weights of a board size, keeping the other sizes
+    """
+    data = {"feature_names": FEATURE_NAMES, "board_sizes": {}}
+    if os.path.exists(path):
+        with open(path) as weights_file:
+            data = json.load(weights_file)
+    data["board_sizes"][str(board_size)] = {
+        PHASE_NAMES[phase_index]: [round(float(weight), 4) for weight in weights]
+        for phase_index, weights in tuned.items()
+    }
+    with open(path, "w") as weights_file:
+        json.dump(data, weights_file, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the evaluation weights of the student agent on self-play")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    steps = parser.add_subparsers(dest="step", required=True)
+
+    collect_parser = steps.add_parser("collect", help="play self-play games and store their positions")
+    collect_parser.add_argument("--board_size", type=int, default=8, choices=BOARD_SIZES)
+    collect_parser.add_argument("--games", type=int, default=1000)
+    collect_parser.add_argument("--depth", type=int, default=2, help="search depth of the self-play moves")
+    collect_parser.add_argument("--epsilon", type=float, default=0.1, help="probability of a random move")
+    collect_parser.add_argument("--seed", type=int, default=0)
+    collect_parser.add_argument("--output", required=True, help="npz file of positions (boards and labels)")
+
+    features_parser = steps.add_parser("features", help="compute the feature vectors of stored positions")
+    features_parser.add_argument("--positions", required=True)
+    features_parser.add_argument("--output", required=True)
+
+    fit_parser = steps.add_parser("fit", help="fit the weights of each phase and write them to a weights file")
+    fit_parser.add_argument("--features", required=True)
+    fit_parser.add_argument("--regularization", type=float, default=0.1,
+                            help="strength of the pull towards the current weights")
+    fit_parser.add_argument("--output", default="weights.json", help="weights file, other board sizes are kept")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.step == "collect":
+        boards, labels = collect(args.board_size, args.games, args.depth, args.epsilon, args.seed, args.workers)
+        np.savez_compressed(args.output, boards=boards, labels=labels)
+        print(f"{args.output}: {len(boards)} positions in {time.time() - start_time:.1f}s")
+    elif args.step == "features":
+        with np.load(args.positions) as data:
+            boards, labels = data["boards"], data["labels"]
+        features, phases, blocked, results = extract_features(boards, labels, args.workers)
+        np.savez_compressed(args.output, board_size=boards.shape[1], features=features, phases=phases,
+                            blocked=blocked, results=results)
+        print(f"{args.output}: {len(features)} feature vectors in {time.time() - start_time:.1f}s")
+    else:
+        with np.load(args.features) as data:
+            board_size = int(data["board_size"])
+            features, phases, blocked, results = data["features"], data["phases"], data["blocked"], data["results"]
+        tuned = fit(board_size, features, phases, blocked.astype(np.float64), results, args.regularization,
+                    args.workers)
+        write_weights(args.output, board_size, tuned)
+        for phase_index, weights in tuned.items():
+            print(f"{PHASE_NAMES[phase_index]}: " + ", ".join(
+                f"{name} {weight:.2f}" for name, weight in zip(FEATURE_NAMES, weights)))
+        print(f"{args.output}: {board_size}x{board_size} weights in {time.time() - start_time:.1f}s")
+
+if __name__ == "__main__":
+    main()